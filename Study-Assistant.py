@@ -1,157 +1,68 @@
-import os
 import re
-import tempfile
+import uuid
 import streamlit as st
-from dotenv import load_dotenv
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_groq import ChatGroq
 from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
 from langchain_core.messages import AIMessage, HumanMessage
-import pdfplumber
-import pytesseract
+from study_assistant import metrics
+from study_assistant.cache import content_hash
+from study_assistant.text_store import as_text
+from study_assistant.corpus import DocFilter
+from study_assistant.engine import (
+    file_hash,
+    generate_response,
+    get_corpus,
+    get_document_cache,
+    get_job_queue,
+    get_reranker,
+    get_response_cache,
+    make_llm,
+    make_retriever,
+    quiz_questions,
+    submit_corpus_document,
+    submit_document,
+)
+from study_assistant.mapreduce import SUMMARY_MAP_PROMPT, map_reduce
+from study_assistant.memory import ConversationMemory, make_llm_summarizer
+from study_assistant.jobs import DONE
+from study_assistant.retrieval import HybridRetriever
 
 # ===============================
-# 🌐 Environment Variables
+# 📄 Background Processing Progress
 # ===============================
-load_dotenv()
-groq_api_key = os.getenv("GROQ_API_KEY")
-google_api_key = os.getenv("GOOGLE_API_KEY")
+def job_status_text(job):
+    if job.stage == "ocr" and job.ocr_total:
+        return f"{job.name}: OCR page {job.ocr_done}/{job.ocr_total}"
+    if job.stage in ("extracting", "indexing"):
+        total = f"/{job.pages_total}" if job.pages_total else ""
+        return f"{job.name}: {job.pages_indexed}{total} page(s) indexed, {job.chunks} chunks"
+    return f"{job.name}: {job.stage}..."
 
-# ===============================
-# 🧠 Chatbot Functions
-# ===============================
-def generate_response(command, text_content, llm, vectorstore=None, chat_history=None):
+@st.fragment(run_every=1.0)
+def job_progress(jobs):
     """
-    Generate response based on user command with chat history context
+    Live progress for background ingestion jobs; reruns the app once they finish
     """
-    command = command.lower().strip()
-    if command.startswith(("/quiz", "generate quiz", "create quiz")):
-        return generate_quiz(text_content, llm)
-    elif command.startswith(("/summary", "generate summary", "summarize")):
-        return generate_summary(text_content, llm)
-    else:
-        return answer_question(command, text_content, llm, vectorstore, chat_history)
-
-def generate_quiz(text_content, llm):
-    prompt_qa = PromptTemplate(
-        template=(
-            "Generate 3 to 7 multiple choice questions with 4 options each from the content below.\n"
-            "Focus exclusively on conceptual questions only.\n"
-            "Number them sequentially as Q1, Q2, etc.\n"
-            "Mark the correct option clearly using '<-- correct'.\n"
-            "Format each question exactly like this example:\n"
-            "Q1: What is the capital of France?\n"
-            "A. London\n"
-            "B. Paris <-- correct\n"
-            "C. Berlin\n"
-            "D. Madrid\n"
-            "For mathematical questions, use LaTeX format surrounded by $ symbols.\n\n"
-            "Content:\n{text}"
-        ),
-        input_variables=["text"]
-    )
-    formatted_prompt = prompt_qa.format(text=text_content[:12000])
-    response = llm.invoke(formatted_prompt)
-    return response.content
-
-def generate_summary(text_content, llm):
-    summary_prompt = PromptTemplate(
-        template=(
-            "Generate a comprehensive summary of the following content. Include:\n"
-            "1. Key concepts and main ideas\n"
-            "2. Important formulas and equations (presented in LaTeX format between $$ symbols)\n"
-            "3. Critical relationships and dependencies\n"
-            "4. Practical applications or examples mentioned\n\n"
-            "Structure the summary with clear sections and bullet points.\n\n"
-            "Content:\n{text}"
-        ),
-        input_variables=["text"]
-    )
-    formatted_prompt = summary_prompt.format(text=text_content[:10000])
-    response = llm.invoke(formatted_prompt)
-    return response.content
+    if all(job.finished for job in jobs):
+        st.rerun()
+    for job in jobs:
+        if not job.finished:
+            st.progress(job.progress(), text=job_status_text(job))
 
-def answer_question(question, text_content, llm, vectorstore, chat_history=None):
+def upload_hash(uploaded):
     """
-    Answer user question with context from document and chat history
+    Content hash of an upload, computed once per uploaded file rather than on every rerun
     """
-    # Prepare conversation history context
-    history_context = ""
-    if chat_history:
-        # Format: [Human/AI]: message
-        for msg in chat_history:
-            if isinstance(msg, HumanMessage):
-                history_context += f"Human: {msg.content}\n"
-            elif isinstance(msg, AIMessage):
-                history_context += f"AI: {msg.content}\n"
-    
-    # Get document context
-    if vectorstore:
-        related_docs = vectorstore.invoke(question)
-        context = "\n\n".join(doc.page_content for doc in related_docs)
-    else:
-        context = text_content[:8000]
-    
-    # Create prompt with history and document context
-    qa_prompt = PromptTemplate(
-        template=(
-            "Use the following conversation history and document context to answer the question.\n\n"
-            "CONVERSATION HISTORY:\n{history}\n\n"
-            "DOCUMENT CONTEXT:\n{context}\n\n"
-            "QUESTION: {question}\n\n"
-            "Answer in detail with relevant formulas in LaTeX format ($$...$$). "
-            "If unsure, say you don't know."
-        ),
-        input_variables=["history", "context", "question"]
-    )
-    
-    formatted_prompt = qa_prompt.format(
-        history=history_context[:2000],  # Limit history length
-        context=context,
-        question=question
-    )
-    
-    response = llm.invoke(formatted_prompt)
-    return response.content
+    hashes = st.session_state.setdefault("upload_hashes", {})
+    key = getattr(uploaded, "file_id", None) or (uploaded.name, uploaded.size)
+    if key not in hashes:
+        hashes[key] = file_hash(uploaded)
+    return hashes[key]
 
-# ===============================
-# 📄 PDF Processing Function
-# ===============================
-def process_pdf(uploaded_file):
-    text = ""
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-        tmp_file.write(uploaded_file.read())
-        tmp_path = tmp_file.name
-
-    try:
-        # First try standard text extraction
-        with pdfplumber.open(tmp_path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n\n"
-        
-        # If no text found, try OCR-based extraction
-        if not text.strip():
-            st.warning("⚠️ No text extracted from PDF. Trying OCR-based extraction...")
-            images = convert_from_path(tmp_path)
-            for i, image in enumerate(images):
-                img_path = f"temp_page_{i}.jpg"
-                image.save(img_path, "JPEG")
-                page_text = pytesseract.image_to_string(img_path)
-                text += page_text + "\n\n"
-                os.remove(img_path)
-
-    except Exception as e:
-        st.error(f"Error processing PDF: {str(e)}")
-        return None
-    finally:
-        os.unlink(tmp_path)
-
-    return text
+def show_job_error(job, retry):
+    st.error(f"Error processing {job.name}: {job.error or job.status}")
+    if st.button("🔄 Retry", key=f"retry_{job.key}"):
+        retry()
+        st.rerun()
 
 # ===============================
 # 🖥️ Streamlit UI Setup
@@ -169,20 +80,26 @@ session_defaults = {
     "questions": [],
     "summary": "",
     "current_file": None,
+    "doc_hash": None,
+    "partial": False,
     "show_summary": False,
     "show_quiz": False,
     "show_chat": False,
     "chat_history": [],
+    "memory": None,
     "text_content": "",
     "vectorstore": None,
-    "llm": None,
-    "quiz_raw": ""
+    "llm": None
 }
 
 for key, default in session_defaults.items():
     if key not in st.session_state:
         st.session_state[key] = default
 
+# Identifies this browser session in the shared LLM pool's fair queue
+if "user_id" not in st.session_state:
+    st.session_state.user_id = uuid.uuid4().hex
+
 # ===============================
 # 🎨 Custom CSS for Better UI
 # ===============================
@@ -262,51 +179,150 @@ with header:
 # ===============================
 # 📁 PDF Upload UI
 # ===============================
-uploaded_file = st.file_uploader(
-    "📁 Upload your PDF study material",
-    type=["pdf"]
+corpus_mode = st.sidebar.toggle(
+    "📚 Corpus mode", help="Work across many PDFs (e.g. a whole course) with one shared index"
 )
+if corpus_mode:
+    uploaded_file = None
+    uploaded_files = st.file_uploader(
+        "📁 Upload your course PDFs",
+        type=["pdf"],
+        accept_multiple_files=True,
+        key="corpus_uploader"
+    )
+else:
+    uploaded_files = []
+    uploaded_file = st.file_uploader(
+        "📁 Upload your PDF study material",
+        type=["pdf"]
+    )
+
+with st.sidebar.expander("📈 LLM cache", expanded=False):
+    st.json(get_response_cache().stats())
+
+# Prometheus /metrics endpoint, only when METRICS_PORT is set
+metrics.start_metrics_server()
+if st.sidebar.toggle("🔬 Debug panel", help="Per-stage timings, token counts and cache hits on this server"):
+    with st.sidebar.expander("⏱️ Stage timings", expanded=True):
+        summary = metrics.stage_summary()
+        if summary:
+            st.dataframe(
+                [{"stage": stage, **values} for stage, values in summary.items()],
+                hide_index=True, use_container_width=True
+            )
+        else:
+            st.caption("Nothing recorded yet.")
+    with st.sidebar.expander("🧾 Recent spans", expanded=False):
+        st.json(metrics.recent_spans(limit=30))
+
+with st.sidebar.expander("⏳ Processing jobs", expanded=False):
+    for entry in get_job_queue().history(limit=10):
+        st.caption(f"{entry['name']}: {entry['status']} ({entry['pages_indexed']}/{entry['pages_total'] or '?'} pages)")
 
 # ===============================
 # 📊 Main Processing Pipeline
 # ===============================
+active_name = None
+
 if uploaded_file:
     file_name = uploaded_file.name
+    active_name = file_name
 
     if file_name != st.session_state.current_file:
         for key in session_defaults:
             st.session_state[key] = session_defaults[key]
         st.session_state.current_file = file_name
 
-    with st.spinner(f"Processing {file_name}..."):
-        text_content = process_pdf(uploaded_file)
+    # Processing runs in the background; the same file bytes share one job and cached document
+    doc_hash = upload_hash(uploaded_file)
+    job = submit_document(uploaded_file, doc_hash, name=file_name)
+    if job.status == DONE and job.result is not None and doc_hash not in get_document_cache():
+        # Evicted since the job ran; rebuild (usually a warm start from the index store)
+        job = submit_document(uploaded_file, doc_hash, name=file_name, retry=True)
 
-    if not text_content:
-        st.warning("Failed to extract content from PDF. Please try another file.")
+    if job.finished and job.status != DONE:
+        show_job_error(job, lambda: submit_document(uploaded_file, doc_hash, name=file_name, retry=True))
         st.stop()
 
-    st.success(f"✅ Successfully processed {file_name}")
-    st.session_state.text_content = text_content
+    if job.status == DONE:
+        document = get_document_cache().get(doc_hash) if job.result is not None else None
+        if document is None:
+            st.warning("Failed to extract content from PDF. Please try another file.")
+            st.stop()
+
+        st.success(f"✅ Successfully processed {file_name}")
+        st.session_state.text_content = document.text
+        st.session_state.doc_hash = doc_hash
+        st.session_state.partial = False
+        st.session_state.vectorstore = make_retriever(document)
+    else:
+        job_progress([job])
+        partial = job.partial(reranker=get_reranker())
+        if partial is None:
+            st.stop()
+        # Chat and tools work on the pages indexed so far
+        st.info("⏳ Still processing. Answers use the pages indexed so far.")
+        st.session_state.text_content, st.session_state.vectorstore = partial
+        st.session_state.doc_hash = doc_hash
+        st.session_state.partial = True
 
-    # Text splitting
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    chunks = splitter.split_text(text_content)
+elif corpus_mode:
+    corpus = get_corpus()
+    # Only new files are embedded, in the background; known ones are merged already
+    active_jobs = []
+    for corpus_file in uploaded_files or []:
+        corpus_hash = upload_hash(corpus_file)
+        if corpus_hash in corpus:
+            continue
+        job = submit_corpus_document(corpus_file, corpus_hash, name=corpus_file.name)
+        if not job.finished:
+            active_jobs.append(job)
+        elif job.status != DONE:
+            show_job_error(job, lambda f=corpus_file, h=corpus_hash: submit_corpus_document(
+                f, h, name=f.name, retry=True
+            ))
+        elif job.result is None:
+            st.warning(f"No text could be extracted from {corpus_file.name}.")
+    if active_jobs:
+        job_progress(active_jobs)
 
-    # Embeddings + Vectorstore
-    embedding = GoogleGenerativeAIEmbeddings(
-        model="models/embedding-001", google_api_key=google_api_key
-    )
-    vectorstore = FAISS.from_texts(chunks, embedding=embedding)
-    st.session_state.vectorstore = vectorstore.as_retriever(search_kwargs={"k": 4})
-    
-    # Initialize LLM
-    st.session_state.llm = ChatGroq(model="llama3-8b-8192", temperature=0.3, groq_api_key=groq_api_key)
+    if len(corpus):
+        doc_names = {doc_id: meta["name"] for doc_id, meta in corpus.documents.items()}
+        selected_docs = st.sidebar.multiselect(
+            "Search in documents",
+            options=list(doc_names),
+            format_func=doc_names.get,
+            help="Leave empty to search the whole corpus"
+        )
+        # A new upload changes the whole-corpus scope too
+        scope = "corpus:" + content_hash("|".join(sorted(selected_docs)) or f"*{len(corpus)}")
+        if scope != st.session_state.current_file:
+            for key in session_defaults:
+                st.session_state[key] = session_defaults[key]
+            st.session_state.current_file = scope
+            # Summaries and quizzes cover the selected documents, read from disk when used
+            st.session_state.text_content = corpus.text_handle(set(selected_docs) or None)
+
+        active_name = f"{len(selected_docs) or len(corpus)} of {len(corpus)} corpus documents"
+        st.session_state.doc_hash = scope
+        st.session_state.partial = False
+        st.session_state.vectorstore = HybridRetriever(
+            corpus, corpus.bm25, reranker=get_reranker(),
+            metadata_filter=DocFilter(selected_docs) if selected_docs else None
+        )
+
+if active_name:
+    # Initialize LLM (a lightweight handle onto the shared client pool)
+    if st.session_state.llm is None:
+        st.session_state.llm = make_llm(st.session_state.user_id)
+    if st.session_state.memory is None:
+        st.session_state.memory = ConversationMemory(summarize=make_llm_summarizer(st.session_state.llm))
 
     # Update header with chat toggle
     with header:
         col1, col2 = st.columns([0.8, 0.2])
         with col1:
-            st.subheader(f"Working with: {file_name}")
+            st.subheader(f"Working with: {active_name}")
         with col2:
             button_label = "💬 Chat with PDF" if not st.session_state.show_chat else "⬅️ Back to PDF"
             if st.button(button_label, key="chat_toggle", use_container_width=True):
@@ -349,23 +365,37 @@ if st.session_state.get("show_chat", False):
     user_input = st.chat_input("Ask about the PDF...", key="chat_input")
     if user_input:
         st.session_state.chat_history.append(HumanMessage(content=user_input))
-        with st.spinner("Thinking..."):
-            response = generate_response(
-                user_input,
-                st.session_state.text_content,
-                st.session_state.llm,
-                st.session_state.vectorstore,
-                chat_history=st.session_state.chat_history[:-1]
-            )
-            st.session_state.chat_history.append(AIMessage(content=response))
-            st.rerun()
+        with st.chat_message("user"):
+            st.markdown(f'<div class="user-message">{user_input}</div>', unsafe_allow_html=True)
+        # Render tokens as they arrive; the styled message replaces this on rerun
+        with st.chat_message("assistant"):
+            with st.spinner("Thinking..."):
+                response_stream = generate_response(
+                    user_input,
+                    st.session_state.text_content,
+                    st.session_state.llm,
+                    st.session_state.vectorstore,
+                    chat_history=st.session_state.memory,
+                    doc_hash=st.session_state.doc_hash,
+                    stream=True,
+                    partial=st.session_state.partial
+                )
+            response = st.write_stream(response_stream)
+        st.session_state.chat_history.append(AIMessage(content=response))
+        # Memory is updated per message instead of being rebuilt every turn
+        st.session_state.memory.add(HumanMessage(content=user_input))
+        st.session_state.memory.add(AIMessage(content=response))
+        st.rerun()
 
 # ===============================
 # 📄 PDF TOOLS VIEW
 # ===============================
-elif uploaded_file and not st.session_state.show_chat:
+elif active_name and not st.session_state.show_chat:
     # Action buttons
     st.markdown('<div class="action-buttons">', unsafe_allow_html=True)
+    force_regenerate = st.checkbox(
+        "🔁 Force regenerate", help="Skip cached results and ask the model for a fresh summary or quiz"
+    )
     col1, col2 = st.columns([1, 1])
     
     with col1:
@@ -380,77 +410,37 @@ elif uploaded_file and not st.session_state.show_chat:
                     ),
                     input_variables=["text"]
                 )
-                chain = prompt_summary | st.session_state.llm | StrOutputParser()
-                st.session_state.summary = chain.invoke({"text": st.session_state.text_content[:10000]})
-                st.session_state.show_summary = True
+                # Whole document: per-section notes in parallel, then one reduce call
+                summary_stream = map_reduce(
+                    st.session_state.llm, as_text(st.session_state.text_content),
+                    SUMMARY_MAP_PROMPT, prompt_summary, task="notes",
+                    cache=get_response_cache(), doc_hash=st.session_state.doc_hash,
+                    force=force_regenerate, stream=True
+                )
+            # Stream the raw notes; the formatted summary below replaces them
+            live_summary = st.empty()
+            with live_summary.container():
+                st.session_state.summary = st.write_stream(summary_stream)
+            live_summary.empty()
+            st.session_state.show_summary = True
 
     with col2:
         if st.button("🧠 Generate Quiz", use_container_width=True):
             st.session_state.show_summary = False
             with st.spinner("Creating quiz..."):
-                prompt_qa = PromptTemplate(
-                    template=(
-                        "Generate 3-7 multiple choice questions from the PDF content.\n"
-                        "Format each question EXACTLY like:\n"
-                        "Q1: [Question text]\n"
-                        "A. [Option A]\n"
-                        "B. [Option B] <-- correct\n"
-                        "C. [Option C]\n"
-                        "D. [Option D]\n\n"
-                        "Important Rules:\n"
-                        "1. Always mark the correct answer with '<-- correct' after the option\n"
-                        "2. Use LaTeX for math formulas (e.g., $E=mc^2$)\n"
-                        "3. Number questions sequentially starting with Q1\n"
-                        "4. Include exactly 4 options per question\n\n"
-                        "Content:\n{text}"
-                    ),
-                    input_variables=["text"]
-                )
-                chain = prompt_qa | st.session_state.llm | StrOutputParser()
-                quiz_raw = chain.invoke({"text": st.session_state.text_content[:12000]})
-                
-                # Save raw quiz output for debugging
-                st.session_state.quiz_raw = quiz_raw
-
-                # Parse quiz with improved regex
+                # Validated questions appear as they arrive; repeat quizzes come from the question bank
                 questions = []
-                q_blocks = re.split(r'\n(?=Q\d+:)', quiz_raw.strip())
-                
-                for block in q_blocks:
-                    lines = [line.strip() for line in block.split('\n') if line.strip()]
-                    if not lines or not lines[0].startswith('Q'):
-                        continue
-                        
-                    question_text = lines[0].split(':', 1)[1].strip()
-                    options = []
-                    correct_answer = None
-                    
-                    for opt in lines[1:]:
-                        if not opt:
-                            continue
-                            
-                        # Check if this is the correct answer
-                        is_correct = '<-- correct' in opt
-                        clean_opt = re.sub(r'\s*<-- correct\s*', '', opt).strip()
-                        
-                        # Skip if it's not a proper option line
-                        if not re.match(r'^[A-D]\.\s+', clean_opt):
-                            continue
-                            
-                        option_text = clean_opt[2:].strip()  # Remove "A. ", "B. ", etc
-                        options.append(option_text)
-                        
-                        if is_correct:
-                            correct_answer = option_text
-                    
-                    # Only add if we have a valid question
-                    if question_text and options and correct_answer and len(options) >= 4:
-                        questions.append({
-                            "question": question_text,
-                            "options": options[:4],
-                            "answer": correct_answer
-                        })
-                
+                live_quiz = st.empty()
+                with live_quiz.container():
+                    for q in quiz_questions(
+                        st.session_state.text_content, st.session_state.llm,
+                        st.session_state.doc_hash, force=force_regenerate,
+                        partial=st.session_state.partial
+                    ):
+                        questions.append(q)
+                        st.markdown(f"**Question {len(questions)}:** {q['question']}")
+                live_quiz.empty()
+
                 if len(questions) >= 3:
                     st.session_state.questions = questions
                     st.session_state.quiz_submitted = False
@@ -459,10 +449,7 @@ elif uploaded_file and not st.session_state.show_chat:
                     st.session_state.show_quiz = True
                     st.success("Quiz generated successfully!")
                 else:
-                    st.error(f"Failed to generate valid quiz. Only parsed {len(questions)} questions.")
-                    # Debug: Show raw quiz output
-                    with st.expander("Show raw quiz output"):
-                        st.code(quiz_raw)
+                    st.error(f"Failed to generate valid quiz. Only got {len(questions)} valid questions.")
     st.markdown('</div>', unsafe_allow_html=True)
 
     # Summary display
@@ -0,0 +1,8 @@
+"""
+Helpers shared by the PDF Study Assistant Streamlit app.
+"""
+from dotenv import load_dotenv
+
+# Module-level settings below are read from the environment at import time,
+# so .env has to be loaded before any submodule is imported
+load_dotenv()
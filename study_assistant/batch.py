@@ -0,0 +1,174 @@
+"""
+Headless batch generation for a directory of PDFs.
+
+    python -m study_assistant.batch lectures/ --out generated/ --workers 4
+
+Every PDF gets its own output directory with summary.md, quiz.json
+(validated questions) and result.json; its FAISS index goes
+to the index store. Finished steps are skipped when the batch is started
+again, so an interrupted run resumes where it stopped.
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pdfplumber
+
+from study_assistant.engine import file_hash, generate_summary, load_document, make_llm, quiz_questions
+from study_assistant.quiz import QUIZ_SIZE
+
+STEPS = ("summary", "quiz")
+
+
+def _write_atomic(path, text):
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def _read_result(doc_dir):
+    try:
+        return json.loads((doc_dir / "result.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def output_dir(out_root, input_root, pdf_path):
+    # Mirror the input tree so equal file names in different folders don't clash
+    return Path(out_root) / Path(pdf_path).relative_to(input_root).with_suffix("")
+
+
+def is_done(doc_dir, doc_hash, steps):
+    result = _read_result(doc_dir)
+    return bool(
+        result and result.get("status") == "done" and result.get("doc_hash") == doc_hash
+        and set(steps) <= set(result.get("steps", []))
+    )
+
+
+def process_one(pdf_path, doc_dir, steps, doc_hash):
+    """
+    Index one PDF and generate the requested outputs. Runs in a worker process.
+    """
+    doc_dir.mkdir(parents=True, exist_ok=True)
+    previous = _read_result(doc_dir)
+    if previous and previous.get("doc_hash") != doc_hash:
+        # The PDF changed since the last run: regenerate everything
+        for name in ("summary.md", "quiz.json"):
+            (doc_dir / name).unlink(missing_ok=True)
+
+    timings = {}
+    start = time.perf_counter()
+    with pdfplumber.open(pdf_path) as pdf:
+        pages = len(pdf.pages)
+    document = load_document(pdf_path, doc_hash, name=Path(pdf_path).name)
+    timings["index"] = time.perf_counter() - start
+    if document is None:
+        raise ValueError("no text could be extracted")
+
+    llm = make_llm()
+    if "summary" in steps and not (doc_dir / "summary.md").exists():
+        start = time.perf_counter()
+        _write_atomic(doc_dir / "summary.md", generate_summary(document.text, llm, doc_hash))
+        timings["summary"] = time.perf_counter() - start
+
+    if "quiz" in steps and not (doc_dir / "quiz.json").exists():
+        start = time.perf_counter()
+        questions = list(quiz_questions(document.text, llm, doc_hash))
+        if len(questions) < QUIZ_SIZE:
+            # No quiz.json, so the next run retries this file instead of skipping it
+            raise ValueError(f"only {len(questions)} of {QUIZ_SIZE} quiz questions were valid")
+        quiz = {"questions": questions}
+        _write_atomic(doc_dir / "quiz.json", json.dumps(quiz, indent=2, ensure_ascii=False))
+        timings["quiz"] = time.perf_counter() - start
+
+    result = {
+        "status": "done",
+        "file": str(pdf_path),
+        "doc_hash": doc_hash,
+        "steps": sorted(set(steps) | set((previous or {}).get("steps", []))),
+        "pages": pages,
+        "chunks": len(document.chunks),
+        "timings": timings,
+    }
+    _write_atomic(doc_dir / "result.json", json.dumps(result, indent=2))
+    return result
+
+
+def print_report(results, failures, skipped, elapsed):
+    pages = sum(result["pages"] for result in results)
+    print("\n=== Batch report ===")
+    print(f"Processed: {len(results)}  Skipped (already done): {skipped}  Failed: {len(failures)}")
+    print(f"Wall time: {elapsed:.1f}s")
+    if results and elapsed > 0:
+        print(f"Throughput: {len(results) / elapsed * 60:.1f} documents/min, {pages / elapsed:.1f} pages/s")
+        for step in ("index",) + STEPS:
+            durations = [result["timings"][step] for result in results if step in result["timings"]]
+            if durations:
+                print(f"  {step:<8} avg {sum(durations) / len(durations):.2f}s  total {sum(durations):.1f}s")
+    for pdf_path, error in failures:
+        print(f"  FAILED {pdf_path}: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate summaries, quizzes and indexes for a directory of PDFs")
+    parser.add_argument("input_dir", type=Path)
+    parser.add_argument("--out", type=Path, default=Path("generated"), help="output directory (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--steps", default=",".join(STEPS), help="comma-separated subset of: summary,quiz")
+    parser.add_argument("--force", action="store_true", help="ignore previous results and redo every file")
+    args = parser.parse_args(argv)
+
+    steps = [step.strip() for step in args.steps.split(",") if step.strip()]
+    unknown = set(steps) - set(STEPS)
+    if unknown:
+        parser.error(f"unknown steps: {', '.join(sorted(unknown))}")
+
+    pdf_paths = sorted(args.input_dir.rglob("*.pdf"))
+    pending = []
+    skipped = 0
+    for pdf_path in pdf_paths:
+        doc_dir = output_dir(args.out, args.input_dir, pdf_path)
+        doc_hash = file_hash(pdf_path)
+        if args.force:
+            (doc_dir / "result.json").unlink(missing_ok=True)
+            for name in ("summary.md", "quiz.json"):
+                (doc_dir / name).unlink(missing_ok=True)
+        elif is_done(doc_dir, doc_hash, steps):
+            skipped += 1
+            continue
+        pending.append((pdf_path, doc_dir, doc_hash))
+
+    print(f"{len(pdf_paths)} PDFs found, {len(pending)} to process with {args.workers} workers")
+    results, failures = [], []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {
+            pool.submit(process_one, pdf_path, doc_dir, steps, doc_hash): pdf_path
+            for pdf_path, doc_dir, doc_hash in pending
+        }
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                pdf_path = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failures.append((pdf_path, e))
+                    print(f"[{done}/{len(futures)}] FAILED {pdf_path}: {e}")
+                    continue
+                results.append(result)
+                print(f"[{done}/{len(futures)}] {pdf_path} ({result['pages']} pages, {result['chunks']} chunks)")
+        except KeyboardInterrupt:
+            # Finished files keep their outputs; rerun the same command to resume
+            print("\nInterrupted, cancelling pending files...")
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    print_report(results, failures, skipped, time.perf_counter() - start)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
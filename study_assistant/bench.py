@@ -0,0 +1,502 @@
+"""
+Offline benchmark for the ingestion and question-answering hot paths.
+
+    python -m study_assistant.bench --sizes 10,100,1000 --kinds text,mixed,scanned
+    # Record a baseline on this machine first (none is committed: timings
+    # only compare on the same hardware), then compare later runs against it
+    python -m study_assistant.bench --save-baseline bench/baseline.json
+    python -m study_assistant.bench --baseline bench/baseline.json --fail-on-regression
+
+Synthetic PDFs (text layer, scanned images or a mix) are generated from a
+fixed seed and kept in --workdir, so every run measures the same input.
+Text pages carry layout for the structured chunker: a bold numbered heading,
+paragraph gaps and display equations in a maths font. The
+real extraction, splitting (index_pages' batches), embedding (local hashing backend), FAISS build,
+hybrid retrieval and quiz parsing code runs against them; the LLM is a
+canned fake, so no network or API key is needed. Scanned pages need
+tesseract and poppler; without them those scenarios are skipped.
+
+Per stage the report shows throughput, p50/p95 latency of the stage's unit
+of work (a page, an embedding batch, a query, ...) and the peak RSS of this
+process while the stage ran (OCR worker processes are not included).
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+from langchain_community.vectorstores import FAISS
+
+from study_assistant.embeddings import BatchedEmbeddings, HashingEmbeddings
+from study_assistant.engine import make_splitter, process_pdf
+from study_assistant.extract import EQUATION, HEADING, PARAGRAPH, join_pages
+from study_assistant.indexing import INDEX_BATCH_PAGES, split_batch
+from study_assistant.quiz import iter_quiz
+from study_assistant.retrieval import BM25Index, HybridRetriever
+
+KINDS = ("text", "mixed", "scanned")
+STAGES = ("extract", "split", "embed", "faiss_build", "retrieve", "quiz_parse")
+EMBED_BATCH = 64
+QUERIES = 50
+
+_VOCABULARY = (
+    "entropy gradient matrix eigenvalue eigenvector integral derivative theorem lemma proof velocity "
+    "acceleration momentum energy photosynthesis mitochondria enzyme catalyst equilibrium reaction "
+    "probability distribution variance expectation hypothesis regression convergence series limit "
+    "function vector tensor manifold topology algorithm complexity recursion induction invariant"
+).split()
+_FORMULAS = ("E = mc^2", "F = ma", "a^2 + b^2 = c^2", "dS >= dQ/T", "P(A|B) = P(B|A)P(A)/P(B)")
+
+
+# ===============================
+# 📄 Synthetic PDFs
+# ===============================
+def synthetic_page(rng, number, words=180):
+    """
+    (kind, text) blocks of one page: a numbered section heading, paragraphs
+    and, between some of them, a display equation.
+    """
+    title = " ".join(rng.choice(_VOCABULARY) for _ in range(rng.randint(2, 4))).capitalize()
+    blocks = [(HEADING, f"{number} {title}")]
+    sentences = []
+    remaining = words
+    while remaining > 0:
+        length = rng.randint(8, 18)
+        sentence = " ".join(rng.choice(_VOCABULARY) for _ in range(length))
+        if rng.random() < 0.15:
+            sentence += " where " + rng.choice(_FORMULAS)
+        sentences.append(sentence.capitalize() + ".")
+        remaining -= length
+        if len(sentences) == 4 or remaining <= 0:
+            blocks.append((PARAGRAPH, " ".join(sentences)))
+            sentences = []
+            if remaining > 0 and rng.random() < 0.3:
+                blocks.append((EQUATION, rng.choice(_FORMULAS)))
+    return blocks
+
+
+def _wrap(text, width):
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + len(word) + 1 > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}".strip()
+    return lines + [line] if line else lines
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _page_image(blocks, dpi=150):
+    # A letter-size grayscale "scan" of the blocks, as JPEG bytes
+    from PIL import Image, ImageDraw, ImageFont
+
+    width, height = int(8.5 * dpi), int(11 * dpi)
+    image = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=dpi // 6)
+    y = dpi // 2
+    for _, text in blocks:
+        for line in _wrap(text, 70):
+            draw.text((dpi // 2, y), line, fill=0, font=font)
+            y += dpi // 4
+        y += dpi // 8
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=75)
+    return width, height, buffer.getvalue()
+
+
+def write_pdf(path, pages):
+    """
+    Write a minimal PDF. `pages` is a list of (kind, blocks) where kind is
+    "text" (a text layer) or "image" (the text rendered as a scanned image)
+    and blocks are synthetic_page()'s (kind, text).
+    """
+    objects = []
+
+    def add(data):
+        objects.append(data)
+        return len(objects)
+
+    fonts = {
+        PARAGRAPH: (b"F1", 10, add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")),
+        HEADING: (b"F2", 14, add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold >>")),
+        # Named like TeX's maths italic, so extraction marks the line as an equation
+        EQUATION: (b"F3", 11, add(
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /CMMI10 /FontDescriptor %d 0 R >>" % add(
+                b"<< /Type /FontDescriptor /FontName /CMMI10 /Flags 34 /FontBBox [-32 -250 1048 750]"
+                b" /ItalicAngle -14 /Ascent 694 /Descent -194 /CapHeight 683 /StemV 72 >>"
+            )
+        )),
+    }
+    pages_id = add(None)  # filled in once the page ids are known
+    page_ids = []
+    for kind, blocks in pages:
+        if kind == "image":
+            width, height, jpeg = _page_image(blocks)
+            image = add(
+                b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray"
+                b" /BitsPerComponent 8 /Filter /DCTDecode /Length %d >>\nstream\n" % (width, height, len(jpeg))
+                + jpeg + b"\nendstream"
+            )
+            content = b"q 612 0 0 792 0 0 cm /Im1 Do Q"
+            resources = b"<< /XObject << /Im1 %d 0 R >> >>" % image
+        else:
+            content, y = b"BT", 770
+            for block, text in blocks:
+                name, size, _ = fonts[block]
+                x = 200 if block == EQUATION else 40
+                # A gap above every block starts a paragraph
+                y -= size
+                for line in _wrap(text, 95):
+                    content += b" /%s %d Tf 1 0 0 1 %d %d Tm (%s) Tj" % (
+                        name, size, x, y, _escape(line).encode("latin-1", "replace")
+                    )
+                    y -= size + 2
+            content += b" ET"
+            resources = b"<< /Font << %s >> >>" % b" ".join(
+                b"/%s %d 0 R" % (name, font) for name, _, font in fonts.values()
+            )
+        stream = add(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Contents %d 0 R /Resources %s >>"
+            % (pages_id, stream, resources)
+        ))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, data in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + data + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    tmp_path = Path(str(path) + ".tmp")
+    tmp_path.write_bytes(bytes(out))
+    os.replace(tmp_path, path)
+
+
+def synthetic_pdf(workdir, kind, pages, seed=0):
+    """
+    Path of a generated PDF, reused across runs. Mixed PDFs have every
+    fourth page scanned.
+    """
+    # v2: pages with headings, paragraphs and display equations
+    path = Path(workdir) / f"{kind}-{pages}-s{seed}-v2.pdf"
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        rng = random.Random(f"{kind}:{pages}:{seed}")
+        page_kinds = {
+            "text": lambda number: "text",
+            "scanned": lambda number: "image",
+            "mixed": lambda number: "image" if number % 4 == 0 else "text",
+        }[kind]
+        write_pdf(path, [(page_kinds(number), synthetic_page(rng, number)) for number in range(1, pages + 1)])
+    return path
+
+
+def ocr_available():
+    return bool(shutil.which("tesseract") and shutil.which("pdftoppm"))
+
+
+# ===============================
+# ⏱️ Measurement
+# ===============================
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        # ru_maxrss is the lifetime peak (KiB on Linux, bytes on macOS)
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+class PeakRSS:
+    """
+    Samples this process's resident set size on a thread while the block runs.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = _rss_bytes()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def summarize(samples, items, elapsed, peak_rss, unit):
+    return {
+        "unit": unit,
+        "items": items,
+        "seconds": round(elapsed, 4),
+        "throughput": round(items / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(_percentile(samples, 0.5) * 1000, 3),
+        "p95_ms": round(_percentile(samples, 0.95) * 1000, 3),
+        "peak_rss_mb": round(peak_rss / 2 ** 20, 1),
+    }
+
+
+class FakeQuizLLM:
+    """
+    Streams a canned JSON quiz (with one invalid and one duplicate question)
+    in small pieces, like a chat model would.
+    """
+    model_name = "fake-quiz"
+    temperature = 0.0
+
+    def __init__(self, seed=0):
+        rng = random.Random(seed)
+        questions = [
+            {
+                "question": f"Which statement about {' and '.join(rng.sample(_VOCABULARY, 2))} is correct? ({i})",
+                "options": [f"Option {letter} {rng.choice(_VOCABULARY)}" for letter in "ABCD"],
+                "answer": rng.randrange(4),
+            }
+            for i in range(6)
+        ]
+        questions.append(dict(questions[0]))
+        questions.append({"question": "Broken", "options": ["x", "x"], "answer": 9})
+        self._text = json.dumps({"questions": questions})
+
+    def invoke(self, prompt):
+        return type("Message", (), {"content": "- key concept"})()
+
+    def stream(self, prompt):
+        for start in range(0, len(self._text), 16):
+            yield type("Chunk", (), {"content": self._text[start:start + 16]})()
+
+
+# ===============================
+# 🏃 Stages
+# ===============================
+def run_scenario(path, repeat=3, seed=0):
+    """
+    Run every stage `repeat` times on one PDF; returns {stage: summary}.
+    """
+    results = {}
+    embedding = BatchedEmbeddings(HashingEmbeddings(), "hashing-768", cache=None, batch_size=EMBED_BATCH)
+
+    def measure(stage, unit, run):
+        samples, items, elapsed = [], 0, 0.0
+        with PeakRSS() as rss:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run_samples, run_items = run()
+                elapsed += time.perf_counter() - start
+                samples += run_samples
+                items += run_items
+        results[stage] = summarize(samples, items, elapsed, rss.peak, unit)
+
+    state = {}
+
+    def extract():
+        samples, records = [], []
+        start = time.perf_counter()
+        for record in process_pdf(path):
+            now = time.perf_counter()
+            samples.append(now - start)
+            records.append(record)
+            start = now
+        state["records"] = records
+        return samples, len(records)
+
+    def split():
+        # Batches of records (with their layout) through the ingestion splitter;
+        # CHUNKER selects the structured chunker or the recursive splitter
+        splitter = make_splitter()
+        records = state["records"]
+        samples, documents = [], []
+        for begin in range(0, len(records), INDEX_BATCH_PAGES):
+            start = time.perf_counter()
+            final = begin + INDEX_BATCH_PAGES >= len(records)
+            documents += split_batch(splitter, records[begin:begin + INDEX_BATCH_PAGES], final=final)
+            samples.append(time.perf_counter() - start)
+        state["documents"] = documents
+        return samples, len(documents)
+
+    def embed():
+        texts = [document.page_content for document in state["documents"]]
+        samples, vectors = [], []
+        for begin in range(0, len(texts), EMBED_BATCH):
+            start = time.perf_counter()
+            vectors += embedding.embed_documents(texts[begin:begin + EMBED_BATCH])
+            samples.append(time.perf_counter() - start)
+        state["vectors"] = vectors
+        return samples, len(texts)
+
+    def faiss_build():
+        start = time.perf_counter()
+        documents = state["documents"]
+        state["vectorstore"] = FAISS.from_embeddings(
+            list(zip([document.page_content for document in documents], state["vectors"])), embedding,
+            metadatas=[document.metadata for document in documents],
+        )
+        state["bm25"] = BM25Index.from_vectorstore(state["vectorstore"])
+        return [time.perf_counter() - start], len(documents)
+
+    def retrieve():
+        rng = random.Random(seed)
+        retriever = HybridRetriever(state["vectorstore"], state["bm25"])
+        samples = []
+        for _ in range(QUERIES):
+            question = f"what is the relation between {rng.choice(_VOCABULARY)} and {rng.choice(_VOCABULARY)}"
+            start = time.perf_counter()
+            retriever.invoke(question)
+            samples.append(time.perf_counter() - start)
+        return samples, QUERIES
+
+    def quiz_parse():
+        llm = FakeQuizLLM(seed)
+        text = join_pages(state["records"])[:8000]
+        start = time.perf_counter()
+        questions = list(iter_quiz(llm, text, count=5, max_rounds=1))
+        assert len(questions) == 5, f"fake quiz produced {len(questions)} questions"
+        return [time.perf_counter() - start], 1
+
+    stages = {
+        "extract": ("pages", extract),
+        "split": ("chunks", split),
+        "embed": ("chunks", embed),
+        "faiss_build": ("chunks", faiss_build),
+        "retrieve": ("queries", retrieve),
+        "quiz_parse": ("quizzes", quiz_parse),
+    }
+    for stage in STAGES:
+        unit, run = stages[stage]
+        measure(stage, unit, run)
+    return results
+
+
+# ===============================
+# 📊 Reporting & Baselines
+# ===============================
+def print_report(results):
+    print(f"\n{'scenario':<14} {'stage':<12} {'throughput':>16} {'p50 ms':>10} {'p95 ms':>10} {'peak RSS':>10}")
+    for scenario, stages in results.items():
+        for stage, row in stages.items():
+            throughput = f"{row['throughput']:,.1f} {row['unit']}/s"
+            print(
+                f"{scenario:<14} {stage:<12} {throughput:>20} {row['p50_ms']:>10.3f} "
+                f"{row['p95_ms']:>10.3f} {row['peak_rss_mb']:>8.1f}MB"
+            )
+
+
+def compare(results, baseline, threshold=0.15, min_delta_ms=1.0, min_delta_seconds=0.05):
+    """
+    Print p50/throughput changes against a baseline; returns the list of
+    (scenario, stage) pairs that regressed by more than `threshold`.
+    """
+    regressions = []
+    print(f"\nvs baseline (threshold {threshold:.0%}):")
+    for scenario, stages in results.items():
+        for stage, row in stages.items():
+            old = baseline.get(scenario, {}).get(stage)
+            if old is None:
+                continue
+            p50_change = row["p50_ms"] / old["p50_ms"] - 1 if old["p50_ms"] else 0.0
+            throughput_change = row["throughput"] / old["throughput"] - 1 if old["throughput"] else 0.0
+            # Tiny absolute differences are timer noise, whatever the ratio
+            slower = (
+                p50_change > threshold and row["p50_ms"] - old["p50_ms"] > min_delta_ms
+            ) or (
+                throughput_change < -threshold and row["seconds"] - old["seconds"] > min_delta_seconds
+            )
+            if slower:
+                regressions.append((scenario, stage))
+            flag = "REGRESSION" if slower else "ok"
+            print(
+                f"  {scenario:<14} {stage:<12} p50 {p50_change:+7.1%}  throughput {throughput_change:+7.1%}  {flag}"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the ingestion and QA hot paths")
+    parser.add_argument("--sizes", default="10,100", help="comma-separated page counts (default: %(default)s)")
+    parser.add_argument("--kinds", default=",".join(KINDS), help="comma-separated subset of: text,mixed,scanned")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", type=Path, default=Path(".bench"), help="where generated PDFs are kept")
+    parser.add_argument("--out", type=Path, help="write results as JSON")
+    parser.add_argument("--baseline", type=Path, help="compare against a saved results file")
+    parser.add_argument("--save-baseline", type=Path, help="store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown (default: %(default)s)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 on a regression")
+    args = parser.parse_args(argv)
+    # Fail before the (long) run rather than after it
+    if args.baseline and not args.baseline.exists():
+        parser.error(f"baseline {args.baseline} not found; record one first with --save-baseline {args.baseline}")
+
+    kinds = [kind for kind in args.kinds.split(",") if kind]
+    if any(kind != "text" for kind in kinds) and not ocr_available():
+        print("tesseract/poppler not found: skipping scanned and mixed scenarios")
+        kinds = [kind for kind in kinds if kind == "text"]
+
+    results = {}
+    for kind in kinds:
+        for pages in (int(size) for size in args.sizes.split(",")):
+            path = synthetic_pdf(args.workdir, kind, pages, args.seed)
+            print(f"running {kind}-{pages} ({path})...", flush=True)
+            results[f"{kind}-{pages}"] = run_scenario(path, repeat=args.repeat, seed=args.seed)
+    print_report(results)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    for path in (args.out, args.save_baseline):
+        if path:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+In-memory caches shared across Streamlit reruns and sessions.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+
+def content_hash(data):
+    """
+    Stable hex digest used to key documents and pages by content.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by entry count and an approximate byte budget.
+
+    `sizeof` is called once per value on insert; the least recently used
+    entries are evicted until both limits hold again. Caches that share a
+    MemoryBudget are additionally trimmed together to fit it.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=None, sizeof=None, budget=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof or (lambda value: 0)
+        self._data = OrderedDict()  # key -> (value, size, last used)
+        self._lock = threading.RLock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.budget = budget
+        if budget is not None:
+            budget.register(self)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            value, size, _ = self._data[key]
+            self._data[key] = (value, size, time.monotonic())
+            return value
+
+    def put(self, key, value):
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.total_bytes -= self._data.pop(key)[1]
+            self._data[key] = (value, size, time.monotonic())
+            self.total_bytes += size
+            self._evict()
+        # Outside our lock: the budget takes the other caches' locks in turn
+        if self.budget is not None:
+            self.budget.enforce()
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value, size, _ = self._data.pop(key)
+            self.total_bytes -= size
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.total_bytes = 0
+
+    def _evict(self):
+        # Always keep the newest entry, even if it alone exceeds the budget
+        while len(self._data) > 1 and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+        ):
+            _, (_, size, _) = self._data.popitem(last=False)
+            self.total_bytes -= size
+
+    def oldest_use(self):
+        """
+        Last-use time of the least recently used entry that may be evicted
+        (never the only one), or None.
+        """
+        with self._lock:
+            if len(self._data) < 2:
+                return None
+            return next(iter(self._data.values()))[2]
+
+    def evict_oldest(self):
+        with self._lock:
+            if len(self._data) < 2:
+                return 0
+            _, (_, size, _) = self._data.popitem(last=False)
+            self.total_bytes -= size
+            return size
+
+
+class MemoryBudget:
+    """
+    Server-wide byte budget shared by several LRU caches of heap-resident
+    data (documents, pages, ...). While their total is over `max_bytes`, the
+    least recently used entry across all of them is evicted, so whichever
+    cache holds the coldest data shrinks first. File-backed memory maps are
+    left out: the OS pages them out under pressure. max_bytes=None disables it.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self._caches = []
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def register(self, cache):
+        self._caches.append(cache)
+
+    @property
+    def total_bytes(self):
+        return sum(cache.total_bytes for cache in self._caches)
+
+    def enforce(self):
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            while self.total_bytes > self.max_bytes:
+                candidates = [(cache.oldest_use(), index) for index, cache in enumerate(self._caches)]
+                candidates = [candidate for candidate in candidates if candidate[0] is not None]
+                if not candidates:
+                    break
+                self._caches[min(candidates)[1]].evict_oldest()
+                self.evictions += 1
+
+
+@dataclass
+class Document:
+    """
+    Everything derived from one uploaded PDF that is worth keeping between reruns.
+    """
+    doc_hash: str
+    text: str  # or a TextHandle onto the shared text store
+    chunks: list
+    vectorstore: object = None
+    extra: dict = field(default_factory=dict)
+
+    def approx_bytes(self):
+        # Text held by a TextHandle lives in the text store, not here
+        size = len(self.text) if isinstance(self.text, str) else 0
+        size += sum(len(chunk) for chunk in self.chunks)
+        index = getattr(self.vectorstore, "index", None)
+        if index is not None:
+            # FAISS flat indexes store one float32 vector per chunk
+            size += index.ntotal * index.d * 4
+        for value in self.extra.values():
+            if hasattr(value, "approx_bytes"):
+                size += value.approx_bytes()
+        return size
+
+
+class DocumentCache(LRUCache):
+    """
+    Documents keyed by the hash of the uploaded file bytes.
+
+    `get_or_build` makes sure concurrent sessions uploading the same file
+    only run the expensive extraction and embedding once.
+    """
+
+    def __init__(self, max_entries=16, max_bytes=None, budget=None):
+        super().__init__(max_entries, max_bytes, sizeof=Document.approx_bytes, budget=budget)
+        self._build_locks = {}
+        self._build_locks_guard = threading.Lock()
+
+    def get_or_build(self, doc_hash, build):
+        document = self.get(doc_hash)
+        if document is not None:
+            return document
+
+        with self._build_locks_guard:
+            lock = self._build_locks.setdefault(doc_hash, threading.Lock())
+        with lock:
+            # Another session may have finished the build while we waited
+            document = self.get(doc_hash) if doc_hash in self else None
+            if document is None:
+                document = build()
+                if document is not None:
+                    self.put(doc_hash, document)
+        with self._build_locks_guard:
+            self._build_locks.pop(doc_hash, None)
+        return document
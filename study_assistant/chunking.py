@@ -0,0 +1,344 @@
+"""
+Structure-aware chunking of page records.
+
+A fixed-size character splitter cuts through equations, tables and section
+boundaries and repeats a fixed overlap between every pair of chunks.
+`StructuredChunker` instead walks the page stream once, in order, and:
+
+- starts a new chunk at every heading (once the current one has some body),
+  so chunks are aligned to sections and carry their heading path;
+- keeps display equations and table rows whole, splitting oversized tables
+  between rows (repeating the header row) and equations between lines;
+- prefers paragraph and page boundaries, falls back to sentence boundaries
+  and only splits at words for a single over-long sentence;
+- overlaps chunks only when a cut lands inside a paragraph, by carrying the
+  trailing whole sentences that fit in `max_overlap` (and the sentence that
+  introduces an equation or table), instead of a fixed character count.
+
+Layout (headings from font sizes, maths fonts, ruled tables, paragraph gaps)
+comes from the text layer via `extract.page_layout`; OCR'd pages fall back
+to text heuristics (numbered headings, equation-like lines, blank lines).
+"""
+import re
+
+from langchain_core.documents import Document
+
+from study_assistant.extract import EQUATION, HEADING, PARAGRAPH, TABLE, PageRecord
+
+TEXT = "text"
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])")
+LATEX_COMMAND = re.compile(r"\\[A-Za-z]+")
+NUMBERED_HEADING = re.compile(
+    r"^(?:(?i:chapter|part|unit|lecture|appendix|section)\s+[\w.]+|(\d+(?:\.\d+){0,3})\.?)\s+[A-Z]"
+)
+MATH_SYMBOLS = set("=+−×÷·^_∑∏∫√∞≤≥≠≈∂∇±→⇒⇔∈∉⊂⊆∪∩∀∃αβγδεθλμπσφωΔΣΩ")
+STRONG_MATH = set("=∑∏∫√≤≥≠≈∂∇")
+
+
+def looks_like_equation(line):
+    """
+    True for a display-equation line: mostly symbols, with few real words.
+    """
+    stripped = line.strip()
+    if not stripped or len(stripped) > 160:
+        return False
+    if stripped.startswith(("$$", "\\[", "\\begin{")):
+        return True
+    words = re.findall(r"[A-Za-z]{4,}", LATEX_COMMAND.sub(" ", stripped))
+    symbols = sum(char in MATH_SYMBOLS for char in stripped)
+    return any(char in STRONG_MATH for char in stripped) and (symbols >= 2 or len(stripped) <= 40) \
+        and len(words) <= 2
+
+
+def _looks_like_table_row(line):
+    return line.count("|") >= 2 or len(re.findall(r"\S {3,}\S", line)) >= 2
+
+
+def _heading_level(line):
+    # Numbered or labelled headings in text without layout, e.g. "2.1 Entropy"
+    stripped = line.strip()
+    if len(stripped) > 80 or stripped.endswith((".", ",", ";", ":")) or len(stripped.split()) > 10:
+        return 0
+    match = NUMBERED_HEADING.match(stripped)
+    if not match:
+        return 0
+    return match.group(1).count(".") + 1 if match.group(1) else 1
+
+
+def _line_kinds(record):
+    """
+    (kind, level) per line of a page; PARAGRAPH marks body text that starts a
+    new paragraph.
+    """
+    lines = record.text.split("\n")
+    kinds = [(TEXT, 0)] * len(lines)
+    if record.layout is not None:
+        for first, last, kind, level in record.layout:
+            for index in range(first, min(last, len(lines) - 1) + 1):
+                kinds[index] = (kind, level)
+    for index, line in enumerate(lines):
+        if kinds[index][0] not in (TEXT, PARAGRAPH):
+            continue
+        if not line.strip():
+            kinds[index] = (PARAGRAPH, 0)
+        elif looks_like_equation(line):
+            kinds[index] = (EQUATION, 0)
+        elif record.layout is None and _heading_level(line):
+            kinds[index] = (HEADING, _heading_level(line))
+    # A lone "table row" is more likely prose with odd spacing
+    for index, line in enumerate(lines):
+        if kinds[index][0] == TEXT and _looks_like_table_row(line):
+            neighbours = lines[max(0, index - 1):index] + lines[index + 1:index + 2]
+            if any(_looks_like_table_row(other) for other in neighbours):
+                kinds[index] = (TABLE, 0)
+    return lines, kinds
+
+
+def iter_units(record):
+    """
+    Yield (kind, text, level) units of one page in reading order: headings,
+    paragraphs, equations and tables.
+    """
+    lines, kinds = _line_kinds(record)
+    current, current_kind, current_level = [], None, 0
+
+    def unit():
+        separator = " " if current_kind == HEADING else "\n"
+        return current_kind, separator.join(line.strip() if current_kind == HEADING else line
+                                            for line in current), current_level
+
+    for line, (kind, level) in zip(lines, kinds):
+        if kind == PARAGRAPH:
+            if current:
+                yield unit()
+            current, current_kind, current_level = [], TEXT, 0
+            kind = TEXT
+            if not line.strip():
+                continue
+        if kind != current_kind or level != current_level:
+            if current:
+                yield unit()
+            current, current_kind, current_level = [], kind, level
+        current.append(line)
+    if current:
+        yield unit()
+
+
+def split_sentences(text):
+    return [sentence for sentence in SENTENCE_END.split(" ".join(text.split())) if sentence]
+
+
+def _split_words(text, limit):
+    pieces, current = [], ""
+    for word in text.split():
+        if current and len(current) + 1 + len(word) > limit:
+            pieces.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    return pieces + ([current] if current else [])
+
+
+def _split_lines(text, limit, repeat_header=False):
+    lines = text.split("\n")
+    header = lines[0] if repeat_header and len(lines) > 1 else None
+    pieces, current = [], []
+    for line in lines:
+        if current and sum(len(part) + 1 for part in current) + len(line) > limit:
+            pieces.append("\n".join(current))
+            current = [header] if header is not None and line is not header else []
+        current.append(line)
+    return pieces + (["\n".join(current)] if current else [])
+
+
+class StructuredChunker:
+    """
+    Stateful, single-pass chunker for one document.
+
+    Call `feed(records, metadata)` with successive batches of PageRecord; it
+    returns the chunks completed so far as LangChain Documents (the section
+    in progress is held back). OCR'd pages arrive after the text-layer ones;
+    nothing waits for them. A page numbered below one already seen is
+    chunked on its own (with consecutive late pages), under the heading
+    path in force where it was skipped, so its chunks never mix with other
+    pages. `finish()` returns the rest.
+    Chunk metadata has `page` (first page), `page_end` when the chunk spans
+    pages, `heading` (the heading path, "Chapter > Section") and `source`.
+    """
+
+    def __init__(self, chunk_size=1000, max_overlap=None, min_chunk=None):
+        self.chunk_size = chunk_size
+        self.max_overlap = chunk_size * 15 // 100 if max_overlap is None else max_overlap
+        self.min_chunk = chunk_size // 4 if min_chunk is None else min_chunk
+        self._headings = {}  # level -> heading text
+        self._metadata = {}
+        self._done = []
+        self._last_number = 0  # highest page number seen in the main flow
+        self._skipped = {}  # page number skipped by the main flow -> heading path at that point
+        self._late = None  # chunker for the run of late pages in progress
+        self._reset()
+
+    def _reset(self):
+        self._parts = []
+        self._size = 0
+        self._body = False
+        self._open_paragraph = False
+        self._first_page = self._last_page = None
+        self._source = None
+        self._heading = ""
+        self._last_sentence = ""
+
+    def heading_path(self):
+        return " > ".join(self._headings[level] for level in sorted(self._headings))
+
+    def feed(self, records, metadata=None):
+        if metadata is not None:
+            self._metadata = metadata
+        for record in records:
+            if record.number > self._last_number:
+                for number in range(self._last_number + 1, record.number):
+                    self._skipped[number] = dict(self._headings)
+                self._last_number = record.number
+                self._chunk_page(record)
+            else:
+                self._chunk_late_page(record)
+        done, self._done = self._done, []
+        return done
+
+    def finish(self):
+        self._finish_late()
+        self._close()
+        done, self._done = self._done, []
+        return done
+
+    def _chunk_late_page(self, record):
+        late = self._late
+        if late is None or record.number != late._last_number + 1:
+            self._finish_late()
+            late = self._late = StructuredChunker(self.chunk_size, self.max_overlap, self.min_chunk)
+            late._metadata = self._metadata
+            late._headings = self._skipped.get(record.number, {})
+        late._last_number = record.number
+        self._skipped.pop(record.number, None)
+        late._chunk_page(record)
+
+    def _finish_late(self):
+        if self._late is not None:
+            self._late._close()
+            self._done += self._late._done
+            self._late = None
+
+    def create_documents(self, texts, metadatas=None):
+        """
+        Text-splitter compatible one-shot chunking of whole texts.
+        """
+        documents = []
+        for index, text in enumerate(texts):
+            metadata = dict((metadatas or [{}] * len(texts))[index])
+            page = metadata.pop("page", index + 1)
+            source = metadata.pop("source", TEXT)
+            documents += self.feed([PageRecord(page, text, source)], metadata)
+        return documents + self.finish()
+
+    # Chunk assembly
+    def _chunk_page(self, record):
+        for kind, text, level in iter_units(record):
+            self._add(kind, text, level, record)
+        self._page_break()
+
+    def _append(self, text, record, body=True, continues=False):
+        if self._first_page is None:
+            self._first_page, self._source = record.number, record.source
+            self._heading = self.heading_path()
+        self._last_page = record.number
+        if continues and self._parts:
+            self._parts[-1] += " " + text
+        else:
+            self._parts.append(text)
+        self._size += len(text) + 1
+        self._body = self._body or body
+
+    def _close(self, carry=(), record=None):
+        if self._body:
+            content = "\n".join(self._parts)
+            heading = self._heading
+            # Continuation chunks restate their section so they stand alone
+            if heading and not content.startswith(heading.rsplit(" > ", 1)[-1]):
+                content = f"{heading}\n{content}"
+            metadata = dict(self._metadata, page=self._first_page, source=self._source)
+            if self._last_page != self._first_page:
+                metadata["page_end"] = self._last_page
+            if heading:
+                metadata["heading"] = heading
+            self._done.append(Document(page_content=content, metadata=metadata))
+        self._reset()
+        carry = [sentence for sentence in carry if sentence]
+        for sentence in carry:
+            self._append(sentence, record, body=False, continues=sentence is not carry[0])
+        self._open_paragraph = bool(carry)
+
+    def _fits(self, text):
+        return self._size + len(text) + 1 <= self.chunk_size
+
+    def _add(self, kind, text, level, record):
+        if kind == HEADING:
+            if self._body and self._size >= self.min_chunk:
+                self._close()
+            for deeper in [other for other in self._headings if other >= level]:
+                del self._headings[deeper]
+            self._headings[level] = text
+            self._append(text, record, body=False)
+            self._open_paragraph = False
+            self._last_sentence = ""
+            return
+
+        if kind in (EQUATION, TABLE):
+            pieces = [text] if len(text) < self.chunk_size else \
+                _split_lines(text, self.chunk_size, repeat_header=kind == TABLE)
+            for piece in pieces:
+                if self._body and not self._fits(piece):
+                    # The sentence introducing the block travels with it
+                    lead_in = self._last_sentence if len(self._last_sentence) <= self.max_overlap else ""
+                    self._close(carry=[lead_in], record=record)
+                self._append(piece, record)
+            self._open_paragraph = False
+            self._last_sentence = ""
+            return
+
+        # Prose: keep whole paragraphs together where possible
+        if self._fits(text):
+            self._append(text, record)
+            self._open_paragraph = True
+            sentences = split_sentences(text)
+            self._last_sentence = sentences[-1] if sentences else ""
+            return
+        if self._body and self._size >= self.chunk_size // 2:
+            self._close()
+        if self._fits(text):
+            self._add(kind, text, level, record)
+            return
+
+        in_paragraph = []  # sentences of this paragraph in the current chunk
+        for sentence in split_sentences(text):
+            pieces = [sentence] if len(sentence) < self.chunk_size else _split_words(sentence, self.chunk_size // 2)
+            for piece in pieces:
+                if self._body and not self._fits(piece):
+                    carry = []
+                    for previous in reversed(in_paragraph):
+                        if sum(len(part) + 1 for part in carry) + len(previous) > self.max_overlap:
+                            break
+                        carry.insert(0, previous)
+                    self._close(carry=carry, record=record)
+                    in_paragraph = list(carry)
+                self._append(piece, record, continues=bool(in_paragraph))
+                in_paragraph.append(piece)
+                self._last_sentence = piece
+        self._open_paragraph = True
+
+    def _page_break(self):
+        # A full chunk ending on a finished sentence closes at the page boundary
+        if self._body and self._size >= self.chunk_size * 3 // 4 and \
+                (not self._open_paragraph or self._parts[-1].rstrip().endswith((".", "!", "?", ":"))):
+            self._close()
+        self._open_paragraph = False
@@ -0,0 +1,281 @@
+"""
+Corpus mode: many PDFs in one sharded FAISS index.
+
+Each document is embedded on its own and merged into the open shard as one
+contiguous id range, so adding a document never rebuilds what is already
+indexed. On disk, each added document is written as its own segment and
+recorded by one appended journal line, so an add costs O(document). The
+open shard is only written out whole when it reaches `shard_size` chunks
+and is sealed; sealed shards are reloaded memory-mapped afterwards.
+Retrieval can be restricted to a set of documents through FAISS id
+selectors over those ranges.
+
+Layout on disk:
+
+    <root>/manifest.json                     documents and shards as of the last seal
+    <root>/journal.jsonl                     documents added since (one JSON line each)
+    <root>/shards/<n>/                       FAISS.save_local output of a sealed shard
+    <root>/shards/<n>/segments/<doc hash>/   one document of the open shard
+    <root>/texts/<doc hash>.txt              extracted text, for summaries and quizzes
+"""
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from study_assistant.index_store import load_faiss
+from study_assistant.indexing import index_pages
+from study_assistant.retrieval import BM25Index
+from study_assistant.text_store import PageSpool, TextHandle, TextStore
+
+CORPUS_DIR = os.getenv("CORPUS_DIR", ".corpus")
+CORPUS_SHARD_SIZE = int(os.getenv("CORPUS_SHARD_SIZE", "50000"))
+
+
+def _tap(records, on_page):
+    for record in records:
+        on_page(record)
+        yield record
+
+
+class DocFilter:
+    """
+    Metadata filter restricting retrieval to some documents. The corpus
+    turns it into FAISS id selectors instead of filtering after the search.
+    """
+
+    def __init__(self, doc_ids):
+        self.doc_ids = set(doc_ids)
+
+    def __call__(self, metadata):
+        return metadata.get("doc_id") in self.doc_ids
+
+
+class Corpus:
+    def __init__(self, root=CORPUS_DIR, embedding=None, shard_size=CORPUS_SHARD_SIZE):
+        self.root = Path(root)
+        (self.root / "shards").mkdir(parents=True, exist_ok=True)
+        self.texts = TextStore(self.root / "texts")
+        self.embedding = embedding
+        self.shard_size = shard_size
+        self._lock = threading.RLock()
+
+        manifest_path = self.root / "manifest.json"
+        manifest = {"documents": {}, "shards": []}
+        if manifest_path.exists():
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        self.documents = manifest["documents"]
+        self.shard_meta = manifest["shards"]
+        # Documents added after the last seal, in the order they were merged
+        journal = []
+        if self._journal_path.exists():
+            for line in self._journal_path.read_text(encoding="utf-8").splitlines():
+                try:
+                    doc_hash, entry = json.loads(line)
+                except ValueError:
+                    continue  # a line torn by a crash; its document is simply re-added later
+                if doc_hash not in self.documents:
+                    journal.append((doc_hash, entry))
+                    self.documents[doc_hash] = entry
+                    if entry["shard"] == len(self.shard_meta):
+                        self.shard_meta.append({"id": entry["shard"], "chunks": 0, "sealed": False})
+                    self.shard_meta[entry["shard"]]["chunks"] = entry["end"]
+
+        self.shards = []
+        self.bm25 = BM25Index()
+        for meta in self.shard_meta:
+            # Sealed shards are read-only; only the open one is ever written
+            shard = self._load_shard(meta, [item for item in journal if item[1]["shard"] == meta["id"]])
+            self.shards.append(shard)
+            self.bm25.add_documents([
+                shard.docstore.search(doc_id) for doc_id in shard.index_to_docstore_id.values()
+            ])
+
+    @property
+    def _journal_path(self):
+        return self.root / "journal.jsonl"
+
+    def _load_shard(self, meta, journal):
+        path = self._shard_path(meta["id"])
+        shard = load_faiss(path, self.embedding, mmap=meta["sealed"]) if (path / "index.faiss").exists() else None
+        for doc_hash, entry in journal:
+            # Segments already contained in the shard's own files (seal interrupted) are skipped
+            if shard is not None and entry["end"] <= shard.index.ntotal:
+                continue
+            segment = load_faiss(path / "segments" / doc_hash, self.embedding, mmap=False)
+            if shard is None:
+                shard = segment
+            else:
+                shard.merge_from(segment)
+        return shard
+
+    def __contains__(self, doc_hash):
+        return doc_hash in self.documents
+
+    def __len__(self):
+        return len(self.documents)
+
+    def _shard_path(self, shard_id):
+        return self.root / "shards" / f"{shard_id:05d}"
+
+    def _save_manifest(self):
+        tmp_path = self.root / "manifest.json.tmp"
+        tmp_path.write_text(
+            json.dumps({"documents": self.documents, "shards": self.shard_meta}), encoding="utf-8"
+        )
+        os.replace(tmp_path, self.root / "manifest.json")
+
+    def add_document(self, doc_hash, name, records, splitter, on_batch=None):
+        """
+        Extract, embed and add one document. Returns its manifest entry, or
+        None if the document has no text. Adding a known document is a no-op.
+        """
+        if doc_hash in self.documents:
+            return self.documents[doc_hash]
+
+        # Embedding happens outside the lock; only the merge is serialised.
+        # Page text is spooled to disk as it arrives rather than kept in memory
+        spool = PageSpool(dir=self.root / "texts")
+        vectorstore, page_count = index_pages(
+            _tap(records, spool.add), self.embedding, splitter, on_batch=on_batch,
+            metadata={"doc_id": doc_hash, "doc_name": name},
+        )
+        if vectorstore is None:
+            return None
+        new_documents = [
+            vectorstore.docstore.search(doc_id) for doc_id in vectorstore.index_to_docstore_id.values()
+        ]
+
+        with self._lock:
+            if doc_hash in self.documents:
+                return self.documents[doc_hash]
+            new_shard = not self.shard_meta or self.shard_meta[-1]["sealed"]
+            if new_shard:
+                self.shard_meta.append({"id": len(self.shard_meta), "chunks": 0, "sealed": False})
+            meta = self.shard_meta[-1]
+            start = 0 if new_shard else self.shards[-1].index.ntotal
+            end = start + vectorstore.index.ntotal
+            seal = end >= self.shard_size
+            if not seal:
+                # Only this document is written. FAISS merge_from() empties the merged
+                # index, so the segment is saved before it joins the shard
+                vectorstore.save_local(str(self._shard_path(meta["id"]) / "segments" / doc_hash))
+            if new_shard:
+                self.shards.append(vectorstore)
+            else:
+                self.shards[-1].merge_from(vectorstore)
+
+            shard = self.shards[-1]
+            meta["chunks"] = shard.index.ntotal
+            self.texts.put_pages(doc_hash, spool.iter_texts())
+
+            entry = {
+                "name": name,
+                "shard": meta["id"],
+                "start": start,
+                "end": end,
+                "pages": page_count,
+            }
+            self.documents[doc_hash] = entry
+            if seal:
+                self._seal(meta, shard)
+            else:
+                # ...and made visible by one journal line
+                with open(self._journal_path, "a", encoding="utf-8") as journal:
+                    journal.write(json.dumps([doc_hash, entry]) + "\n")
+            self.bm25.add_documents(new_documents)
+            return entry
+
+    def _seal(self, meta, shard):
+        # The full shard is written once; the manifest then covers every document so far
+        path = self._shard_path(meta["id"])
+        shard.save_local(str(path))
+        meta["sealed"] = True
+        self._save_manifest()
+        self._journal_path.unlink(missing_ok=True)
+        shutil.rmtree(path / "segments", ignore_errors=True)
+
+    def text(self, doc_ids=None, limit=None):
+        """
+        Concatenated text of the given documents (default: all), in upload
+        order. With `limit`, only about that many characters are read.
+        """
+        doc_ids = [doc_id for doc_id in self.documents if doc_ids is None or doc_id in doc_ids]
+        parts, size = [], 0
+        for doc_id in doc_ids:
+            if limit is not None and size >= limit:
+                break
+            with open(self.root / "texts" / f"{doc_id}.txt", encoding="utf-8") as f:
+                part = f.read(-1 if limit is None else limit - size)
+            parts.append(part)
+            size += len(part) + 2
+        return "\n\n".join(parts)
+
+    def text_handle(self, doc_ids=None):
+        """
+        TextHandle for text(doc_ids), read only when it is used.
+        """
+        doc_ids = [doc_id for doc_id in self.documents if doc_ids is None or doc_id in doc_ids]
+        size = sum((self.root / "texts" / f"{doc_id}.txt").stat().st_size for doc_id in doc_ids)
+        return TextHandle(lambda limit=None: self.text(doc_ids, limit), size)
+
+    def _selectors(self, doc_ids):
+        # One id selector per shard covering the selected documents' ranges
+        ids_by_shard = {}
+        for doc_id in doc_ids:
+            meta = self.documents.get(doc_id)
+            if meta is not None:
+                ids_by_shard.setdefault(meta["shard"], []).append(np.arange(meta["start"], meta["end"]))
+        return {
+            shard_id: faiss.IDSelectorBatch(np.concatenate(ranges).astype("int64"))
+            for shard_id, ranges in ids_by_shard.items()
+        }
+
+    def _search_shard(self, shard, vector, k, selector=None):
+        params = faiss.SearchParameters(sel=selector) if selector is not None else None
+        distances, positions = shard.index.search(np.array([vector], dtype="float32"), k, params=params)
+        results = []
+        for distance, position in zip(distances[0], positions[0]):
+            if position == -1:
+                continue
+            document = shard.docstore.search(shard.index_to_docstore_id[int(position)])
+            results.append((document, float(distance)))
+        return results
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        """
+        Search every shard (in parallel) and merge by distance. A DocFilter
+        is applied inside FAISS; any other callable filters metadata afterwards.
+        """
+        vector = self.embedding.embed_query(query)
+        with self._lock:
+            shards = list(enumerate(self.shards))
+            selectors = self._selectors(filter.doc_ids) if isinstance(filter, DocFilter) else None
+
+        if selectors is not None:
+            shards = [(shard_id, shard) for shard_id, shard in shards if shard_id in selectors]
+        fetch_k = k if filter is None or selectors is not None else k * 10
+
+        def search(item):
+            shard_id, shard = item
+            selector = selectors[shard_id] if selectors is not None else None
+            if self.shard_meta[shard_id]["sealed"]:
+                return self._search_shard(shard, vector, fetch_k, selector)
+            # The open shard may be receiving a merge
+            with self._lock:
+                return self._search_shard(shard, vector, fetch_k, selector)
+
+        if len(shards) > 1:
+            with ThreadPoolExecutor(max_workers=min(8, len(shards))) as pool:
+                results = [result for part in pool.map(search, shards) for result in part]
+        else:
+            results = [result for item in shards for result in search(item)]
+
+        if filter is not None and selectors is None:
+            results = [(doc, score) for doc, score in results if filter(doc.metadata)]
+        return sorted(results, key=lambda item: item[1])[:k]
@@ -0,0 +1,308 @@
+"""
+Embedding layer used for indexing: pluggable backends (remote or local CPU),
+batched concurrent requests with retry on rate limits, and a persistent
+per-chunk embedding cache.
+
+Offline micro-benchmark against the fake backend:
+
+    python -m study_assistant.embeddings --texts 5000 --latency 0.05
+    python -m study_assistant.embeddings --backend hashing --texts 5000
+"""
+import argparse
+import math
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from study_assistant import metrics
+from study_assistant.cache import LRUCache, content_hash
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "google")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "4"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", ".embedding_cache.sqlite3")
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "4096"))
+
+
+def normalize_query(text):
+    """
+    Collapse case, whitespace and trailing punctuation so near-identical
+    questions share one query embedding.
+    """
+    return " ".join(text.lower().split()).rstrip(" ?!.")
+
+
+def is_rate_limit_error(exc):
+    """
+    Best-effort detection of provider rate-limit / quota errors.
+    """
+    status = getattr(exc, "status_code", None) or getattr(exc, "code", None)
+    if status == 429:
+        return True
+    if type(exc).__name__ in ("ResourceExhausted", "RateLimitError", "TooManyRequests"):
+        return True
+    message = str(exc).lower()
+    return "429" in message or "rate limit" in message or "quota" in message
+
+
+class EmbeddingCache:
+    """
+    SQLite cache of embedding vectors keyed by (model, chunk text hash).
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, model, text_hashes):
+        found = {}
+        hashes = list(set(text_hashes))
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                part = hashes[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(part))})",
+                    [model, *part],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[text_hash] = vector.tolist()
+        return found
+
+    def put_many(self, model, items):
+        rows = [(model, text_hash, array("f", vector).tobytes()) for text_hash, vector in items]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    Wraps any LangChain `Embeddings` backend.
+
+    Documents are deduplicated, looked up in the cache, and only the missing
+    ones are sent to the backend in batches of `batch_size`, with at most
+    `max_concurrency` batches in flight. Rate-limited batches are retried
+    with exponential backoff. Query embeddings are kept in an in-memory LRU
+    so repeated questions skip the backend.
+    """
+
+    def __init__(self, backend, model_name, cache=None, batch_size=EMBED_BATCH_SIZE,
+                 max_concurrency=EMBED_MAX_CONCURRENCY, max_retries=6, backoff=1.0,
+                 query_cache_size=QUERY_CACHE_SIZE):
+        self.backend = backend
+        self.model_name = model_name
+        self.cache = cache
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.query_cache = LRUCache(max_entries=query_cache_size)
+
+    def _with_retry(self, fn, *args):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return fn(*args)
+            except Exception as e:
+                if attempt == self.max_retries or not (
+                    is_rate_limit_error(e) or isinstance(e, (ConnectionError, TimeoutError))
+                ):
+                    raise
+                delay = self.backoff * (2 ** attempt)
+                time.sleep(delay + random.uniform(0, delay / 2))
+
+    def _embed_batch(self, texts):
+        return self._with_retry(self.backend.embed_documents, texts)
+
+    def embed_documents(self, texts):
+        with metrics.span("embed", chunks=len(texts), bytes=sum(len(text) for text in texts)) as span:
+            return self._embed_documents(texts, span)
+
+    def _embed_documents(self, texts, span):
+        hashes = [content_hash(text) for text in texts]
+        vectors = self.cache.get_many(self.model_name, hashes) if self.cache is not None else {}
+
+        missing = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in vectors:
+                missing.setdefault(text_hash, text)
+        span.update(cached=len(texts) - len(missing), computed=len(missing))
+        metrics.cache_event("embedding", True, len(texts) - len(missing))
+        metrics.cache_event("embedding", False, len(missing))
+        if missing:
+            missing_hashes = list(missing)
+            batches = [
+                missing_hashes[start:start + self.batch_size]
+                for start in range(0, len(missing_hashes), self.batch_size)
+            ]
+            workers = max(1, min(self.max_concurrency, len(batches)))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = pool.map(self._embed_batch, [[missing[h] for h in batch] for batch in batches])
+                for batch, batch_vectors in zip(batches, results):
+                    computed = list(zip(batch, batch_vectors))
+                    vectors.update(computed)
+                    if self.cache is not None:
+                        self.cache.put_many(self.model_name, computed)
+
+        return [vectors[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text):
+        key = normalize_query(text)
+        with metrics.span("embed_query") as span:
+            vector = self.query_cache.get(key)
+            span["cache_hit"] = vector is not None
+            metrics.cache_event("query_embedding", vector is not None)
+            if vector is None:
+                vector = self.query_cache.put(key, self._with_retry(self.backend.embed_query, text))
+        return vector
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic offline backend: each text maps to a fixed pseudo-random
+    unit vector. `latency` seconds are slept per call to mimic a remote API.
+    """
+
+    def __init__(self, size=768, latency=0.0):
+        self.size = size
+        self.latency = latency
+
+    def _vector(self, text):
+        rng = random.Random(content_hash(text))
+        vector = [rng.gauss(0.0, 1.0) for _ in range(self.size)]
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=1 << 16)
+def _feature_hash(feature):
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(feature.encode("utf-8"))
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Local CPU backend with no model download and no network.
+
+    Word unigrams and bigrams are signed-hashed into `size` buckets (a sparse
+    random projection of the bag of words), term frequencies are damped with
+    log1p and rows are L2-normalised. The whole batch is built as one NumPy
+    matrix, so embedding cost is a few milliseconds per hundred chunks.
+    """
+
+    def __init__(self, size=768):
+        self.size = size
+        self.model_name = f"hashing-{size}"
+
+    def embed_documents(self, texts):
+        rows, buckets, signs = [], [], []
+        for row, text in enumerate(texts):
+            tokens = _TOKEN_RE.findall(text.lower())
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                h = _feature_hash(feature)
+                rows.append(row)
+                buckets.append(h % self.size)
+                signs.append(1.0 if h & 0x80000000 else -1.0)
+
+        flat = np.asarray(rows, dtype=np.int64) * self.size + np.asarray(buckets, dtype=np.int64)
+        counts = np.bincount(flat, weights=np.asarray(signs), minlength=len(texts) * self.size)
+        matrix = counts.reshape(len(texts), self.size)
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1.0, norms)
+        return matrix.astype(np.float32).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def make_embedding_backend(backend=EMBEDDING_BACKEND, model=EMBEDDING_MODEL):
+    """
+    Build the configured backend. Returns (embeddings, model_name); the model
+    name keys the embedding cache and the index store.
+    """
+    if backend == "google":
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+        model = model or "models/embedding-001"
+        embeddings = GoogleGenerativeAIEmbeddings(model=model, google_api_key=os.getenv("GOOGLE_API_KEY"))
+        return embeddings, model
+    if backend == "sentence-transformers":
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+
+        model = model or "sentence-transformers/all-MiniLM-L6-v2"
+        embeddings = HuggingFaceEmbeddings(model_name=model, encode_kwargs={"normalize_embeddings": True})
+        return embeddings, f"st:{model}"
+    if backend == "hashing":
+        embeddings = HashingEmbeddings(size=int(model or 768))
+        return embeddings, embeddings.model_name
+    if backend == "fake":
+        return FakeEmbeddings(size=int(model or 768)), "fake"
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend!r}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark BatchedEmbeddings against a local backend")
+    parser.add_argument("--backend", choices=["fake", "hashing"], default="fake")
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated seconds per backend call")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=EMBED_MAX_CONCURRENCY)
+    parser.add_argument("--cache", default=":memory:", help="embedding cache path (default: in-memory)")
+    args = parser.parse_args(argv)
+
+    texts = [f"chunk {i}: " + "lorem ipsum " * 40 for i in range(args.texts)]
+    backend = FakeEmbeddings(latency=args.latency) if args.backend == "fake" else HashingEmbeddings()
+    embeddings = BatchedEmbeddings(
+        backend, args.backend, cache=EmbeddingCache(args.cache),
+        batch_size=args.batch_size, max_concurrency=args.concurrency,
+    )
+    for label in ("cold", "warm"):
+        start = time.perf_counter()
+        embeddings.embed_documents(texts)
+        elapsed = time.perf_counter() - start
+        print(f"{label}: {len(texts)} texts in {elapsed:.3f}s ({len(texts) / elapsed:,.0f} texts/s)")
+
+
+if __name__ == "__main__":
+    main()
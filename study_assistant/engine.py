@@ -0,0 +1,505 @@
+"""
+Headless study-assistant engine: PDF extraction, indexing, summaries,
+quizzes and question answering, with no Streamlit dependency.
+
+Process-wide resources (caches, embedding backend, index store, corpus) are
+created lazily on first use and shared by every caller in the process, which
+is what the Streamlit app, the batch CLI and scripts all rely on.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from langchain_core.prompts import PromptTemplate
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from study_assistant import metrics
+from study_assistant.cache import Document, DocumentCache, LRUCache, MemoryBudget
+from study_assistant.chunking import StructuredChunker
+from study_assistant.corpus import Corpus
+from study_assistant.embeddings import BatchedEmbeddings, EmbeddingCache, make_embedding_backend
+from study_assistant.extract import iter_page_records
+from study_assistant.index_store import IndexStore
+from study_assistant.indexing import index_pages, vectorstore_chunks
+from study_assistant.jobs import INGEST_WORKERS, JOB_DB_PATH, JobQueue
+from study_assistant.llm_cache import ResponseCache
+from study_assistant.llm_pool import get_llm_pool
+from study_assistant.mapreduce import SUMMARY_MAP_PROMPT, map_reduce
+from study_assistant.memory import as_memory
+from study_assistant.quiz import QUIZ_SIZE, QuestionBank, format_question, iter_quiz
+from study_assistant.retrieval import BM25Index, CrossEncoderReranker, HybridRetriever, format_context
+from study_assistant.text_store import PageSpool, TextStore, as_text
+
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama3-8b-8192")
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.3"))
+DOC_CACHE_MAX_ENTRIES = int(os.getenv("DOC_CACHE_MAX_ENTRIES", "16"))
+DOC_CACHE_MAX_MB = int(os.getenv("DOC_CACHE_MAX_MB", "512"))
+PAGE_CACHE_MAX_MB = int(os.getenv("PAGE_CACHE_MAX_MB", "64"))
+INDEX_STORE_DIR = os.getenv("INDEX_STORE_DIR", ".index_store")
+INDEX_STORE_MAX_MB = os.getenv("INDEX_STORE_MAX_MB")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "google")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+RERANK_MODEL = os.getenv("RERANK_MODEL")
+CORPUS_DIR = os.getenv("CORPUS_DIR", ".corpus")
+TEXT_STORE_DIR = os.getenv("TEXT_STORE_DIR", ".text_store")
+TEXT_STORE_MAX_MB = int(os.getenv("TEXT_STORE_MAX_MB", "256"))  # memory-mapped text kept open
+TEXT_STORE_DISK_MB = os.getenv("TEXT_STORE_DISK_MB", "2048")  # text files kept on disk; empty for no cap
+SERVER_MEMORY_MB = os.getenv("SERVER_MEMORY_MB")  # unset: only the per-cache limits apply
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR")  # unset: the system temp dir
+SPOOL_BLOCK_BYTES = 1024 * 1024
+
+CHUNKER = os.getenv("CHUNKER", "structured")  # "recursive": fixed-size character splitter
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200  # recursive splitter only; structured chunks overlap adaptively
+
+
+# ===============================
+# 🗄️ Shared Resources
+# ===============================
+def _shared(factory):
+    """
+    Build the resource once per process, even under concurrent first use.
+    """
+    lock = threading.Lock()
+    instance = []
+
+    @wraps(factory)
+    def get():
+        if not instance:
+            with lock:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+    return get
+
+
+def _cache_gauges(name, cache):
+    # Size of an in-memory LRU cache, read when metrics are scraped
+    return lambda: [
+        ("cache_entries", {"cache": name}, len(cache)),
+        ("cache_bytes", {"cache": name}, cache.total_bytes),
+    ]
+
+
+@_shared
+def get_memory_budget():
+    # One byte budget across the heap-resident document and page caches of this process
+    budget = MemoryBudget(int(float(SERVER_MEMORY_MB) * 1024 * 1024) if SERVER_MEMORY_MB else None)
+    metrics.register_collector(lambda: [
+        ("memory_budget_bytes", {}, budget.max_bytes or 0),
+        ("memory_budget_used_bytes", {}, budget.total_bytes),
+        ("memory_budget_evictions", {}, budget.evictions),
+    ])
+    return budget
+
+
+@_shared
+def get_document_cache():
+    cache = DocumentCache(
+        max_entries=DOC_CACHE_MAX_ENTRIES, max_bytes=DOC_CACHE_MAX_MB * 1024 * 1024, budget=get_memory_budget()
+    )
+    metrics.register_collector(_cache_gauges("document", cache))
+    return cache
+
+
+@_shared
+def get_page_cache():
+    # Extracted pages keyed by page content fingerprint
+    cache = LRUCache(
+        max_entries=100_000,
+        max_bytes=PAGE_CACHE_MAX_MB * 1024 * 1024,
+        sizeof=lambda record: len(record.text),
+        budget=get_memory_budget(),
+    )
+    metrics.register_collector(_cache_gauges("page", cache))
+    return cache
+
+
+@_shared
+def get_text_store():
+    # Document text on disk, read through shared memory maps; sessions hold handles
+    # Not part of the memory budget: mapped text is file-backed and reclaimable by the OS.
+    # Capped on disk; an evicted text is restored from the index store on the next load
+    max_disk_bytes = int(float(TEXT_STORE_DISK_MB) * 1024 * 1024) if TEXT_STORE_DISK_MB else None
+    store = TextStore(TEXT_STORE_DIR, max_open_bytes=TEXT_STORE_MAX_MB * 1024 * 1024, max_disk_bytes=max_disk_bytes)
+    metrics.register_collector(_cache_gauges("text_map", store._maps))
+    return store
+
+
+@_shared
+def get_response_cache():
+    # LLM responses keyed by model, temperature, template id and document hash
+    return ResponseCache()
+
+
+@_shared
+def get_question_bank():
+    # Validated quiz questions per document, reused by repeat quizzes
+    return QuestionBank()
+
+
+@_shared
+def get_index_store():
+    max_bytes = int(float(INDEX_STORE_MAX_MB) * 1024 * 1024) if INDEX_STORE_MAX_MB else None
+    return IndexStore(INDEX_STORE_DIR, max_bytes=max_bytes)
+
+
+@_shared
+def get_embeddings():
+    # Backend picked by EMBEDDING_BACKEND (google, sentence-transformers, hashing);
+    # batched, rate-limit aware and backed by a persistent per-chunk vector cache
+    backend, model_name = make_embedding_backend(EMBEDDING_BACKEND, EMBEDDING_MODEL)
+    return BatchedEmbeddings(backend, model_name, cache=EmbeddingCache())
+
+
+@_shared
+def get_reranker():
+    # Optional local cross-encoder, enabled by setting RERANK_MODEL
+    return CrossEncoderReranker(RERANK_MODEL) if RERANK_MODEL else None
+
+
+@_shared
+def get_corpus():
+    # One sharded index for every PDF added in corpus mode
+    return Corpus(CORPUS_DIR, embedding=get_embeddings())
+
+
+@_shared
+def get_job_queue():
+    # Background ingestion shared by every session in the process
+    queue = JobQueue(workers=INGEST_WORKERS, db_path=JOB_DB_PATH)
+    metrics.register_collector(
+        lambda: [("ingest_jobs_active", {}, sum(not job.finished for job in queue.jobs()))]
+    )
+    return queue
+
+
+def make_llm(user_id="default"):
+    """
+    Chat model for one user, backed by the process-wide rate-limited LLM pool.
+    """
+    return get_llm_pool().client(GROQ_MODEL, LLM_TEMPERATURE, user_id)
+
+
+def make_splitter():
+    """
+    Chunker for one document (the structured chunker keeps state across batches).
+    """
+    if CHUNKER == "recursive":
+        return RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return StructuredChunker(chunk_size=CHUNK_SIZE)
+
+
+# ===============================
+# 📄 PDF Processing & Indexing
+# ===============================
+def process_pdf(source, page_cache=None, on_ocr_start=None, on_ocr_progress=None):
+    """
+    Yield a PageRecord per page of a PDF as soon as it is extracted.
+    `source` is a file path or a binary file-like object such as an upload.
+    """
+    with spooled(source) as path:
+        yield from iter_page_records(path, page_cache, on_ocr_start=on_ocr_start, on_ocr_progress=on_ocr_progress)
+
+
+def _iter_blocks(source, block_size=SPOOL_BLOCK_BYTES):
+    # File contents in fixed-size blocks, never the whole file at once
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            while block := f.read(block_size):
+                yield block
+    elif hasattr(source, "getbuffer"):
+        # In-memory uploads: zero-copy slices, independent of the read position
+        # (so a worker can spool while the session hashes the same upload)
+        with source.getbuffer() as buffer:
+            for start in range(0, len(buffer), block_size):
+                with buffer[start:start + block_size] as block:
+                    yield block
+    else:
+        source.seek(0)
+        while block := source.read(block_size):
+            yield block
+
+
+def file_hash(source):
+    """
+    Content hash of a PDF path or upload (same as content_hash of its bytes),
+    computed block by block.
+    """
+    digest = hashlib.sha256()
+    for block in _iter_blocks(source):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+@contextmanager
+def spooled(source):
+    """
+    Path of the PDF on disk: a path is used as is, an upload is copied to a
+    temporary file in blocks and removed afterwards.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        yield os.fspath(source)
+        return
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_SPOOL_DIR, delete=False, suffix=".pdf") as tmp_file:
+        for block in _iter_blocks(source):
+            tmp_file.write(block)
+    # Drop this frame's references to the upload (the last block is a view of it)
+    # while the spooled copy is in use
+    source = block = None
+    try:
+        yield tmp_file.name
+    finally:
+        os.unlink(tmp_file.name)
+
+
+def _document(doc_hash, text, vectorstore):
+    return Document(
+        doc_hash=doc_hash, text=text, chunks=vectorstore_chunks(vectorstore), vectorstore=vectorstore,
+        extra={"bm25": BM25Index.from_vectorstore(vectorstore)},
+    )
+
+
+def _tap(records, on_page):
+    for record in records:
+        on_page(record)
+        yield record
+
+
+def build_document(source, doc_hash, name=None, on_batch=None, on_ocr_start=None, on_ocr_progress=None,
+                   on_page=None, lock=None):
+    """
+    Extract, split and embed a PDF, or reload its index from the index store.
+    Returns a Document, or None if no text could be extracted. `on_page` sees
+    every extracted PageRecord; `lock` is passed to index_pages().
+    """
+    embedding = get_embeddings()
+    with metrics.span("ingest", doc_hash=doc_hash) as span:
+        document = _build_document(source, doc_hash, name, embedding, span, on_batch, on_ocr_start,
+                                   on_ocr_progress, on_page, lock)
+        if document is not None:
+            span.update(chunks=len(document.chunks), bytes=len(document.text))
+        return document
+
+
+def _build_document(source, doc_hash, name, embedding, span, on_batch, on_ocr_start, on_ocr_progress,
+                    on_page, lock):
+    # Warm start: an index built by a previous run or another replica
+    index_store = get_index_store()
+    text_store = get_text_store()
+    text_content = text_store.get(doc_hash)
+    store_key = IndexStore.make_key(doc_hash, embedding.model_name, CHUNK_SIZE, CHUNK_OVERLAP, CHUNKER)
+    stored = index_store.load(store_key, embedding, with_text=text_content is None)
+    span["index_store_hit"] = stored is not None
+    metrics.cache_event("index_store", stored is not None)
+    if stored is not None:
+        vectorstore, stored_text = stored
+        if text_content is None:
+            text_content = text_store.put(doc_hash, stored_text)
+        return _document(doc_hash, text_content, vectorstore)
+
+    # Pages are split and embedded in batches while extraction continues; their
+    # text goes to a spool file as it arrives instead of staying in memory
+    spool = PageSpool(dir=UPLOAD_SPOOL_DIR)
+    records = _tap(process_pdf(source, get_page_cache(), on_ocr_start, on_ocr_progress), spool.add)
+    if on_page is not None:
+        records = _tap(records, on_page)
+    vectorstore, _ = index_pages(records, embedding, make_splitter(), on_batch=on_batch, lock=lock)
+    if vectorstore is None:
+        return None
+    # Copied in page order (as join_pages() would join them); the Document keeps a handle
+    text_content = text_store.put_pages(doc_hash, spool.iter_texts())
+
+    index_store.save(
+        store_key, vectorstore, text_content,
+        doc_hash=doc_hash, name=name or os.path.basename(getattr(source, "name", str(source))),
+        model=embedding.model_name, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, chunker=CHUNKER,
+    )
+    return _document(doc_hash, text_content, vectorstore)
+
+
+def load_document(source, doc_hash=None, **kwargs):
+    """
+    Document for a PDF from the shared document cache, building it on a miss.
+    Keyword arguments are passed to build_document().
+    """
+    doc_hash = doc_hash or file_hash(source)
+    return get_document_cache().get_or_build(doc_hash, lambda: build_document(source, doc_hash, **kwargs))
+
+
+def _page_total(path):
+    import pdfplumber
+
+    try:
+        with pdfplumber.open(path) as pdf:
+            return len(pdf.pages)
+    except Exception:
+        return 0
+
+
+def submit_document(source, doc_hash=None, name=None, retry=False):
+    """
+    Load a PDF into the document cache on a background worker. Returns the
+    Job, whose result is the document hash (None if the PDF has no text).
+    Concurrent submissions of the same file bytes share one job. While it
+    runs, `job.partial()` gives a retriever over the pages indexed so far.
+    """
+    doc_hash = doc_hash or file_hash(source)
+    name = name or os.path.basename(getattr(source, "name", str(source)))
+    # The job lets go of the upload once it is spooled to disk
+    upload = [source]
+
+    def run(job):
+        # Uploads are spooled to disk by the worker, so nothing is copied in the session
+        with spooled(upload.pop()) as path:
+            job.update(pages_total=_page_total(path))
+            document = load_document(
+                path, doc_hash, name=name, on_batch=job.on_batch, on_ocr_start=job.on_ocr_start,
+                on_ocr_progress=job.on_ocr_progress, on_page=job.on_page, lock=job.lock,
+            )
+        # The document itself lives in the document cache, under its byte budget
+        return doc_hash if document is not None else None
+
+    return get_job_queue().submit(f"document:{doc_hash}", name, run, retry=retry)
+
+
+def submit_corpus_document(source, doc_hash=None, name=None, retry=False):
+    """
+    Add a PDF to the corpus on a background worker. Returns the Job, whose
+    result is the document's manifest entry.
+    """
+    doc_hash = doc_hash or file_hash(source)
+    name = name or os.path.basename(getattr(source, "name", str(source)))
+    upload = [source]
+
+    def run(job):
+        with spooled(upload.pop()) as path:
+            job.update(pages_total=_page_total(path))
+            records = process_pdf(path, get_page_cache(), job.on_ocr_start, job.on_ocr_progress)
+            return get_corpus().add_document(
+                doc_hash, name, _tap(records, job.on_page), make_splitter(), on_batch=job.on_batch
+            )
+
+    return get_job_queue().submit(f"corpus:{doc_hash}", name, run, retry=retry)
+
+
+def make_retriever(document, metadata_filter=None):
+    # Dense + BM25 keyword search over the same chunks, optionally re-ranked
+    return HybridRetriever(
+        document.vectorstore, document.extra["bm25"], reranker=get_reranker(), metadata_filter=metadata_filter
+    )
+
+
+# ===============================
+# 🧠 Chatbot Functions
+# ===============================
+def generate_response(command, text_content, llm, vectorstore=None, chat_history=None, doc_hash=None,
+                      stream=False, partial=False):
+    """
+    Generate response based on user command with chat history context.
+    With stream=True a generator of text pieces is returned instead of a string.
+    """
+    command = command.lower().strip()
+    if command.startswith(("/quiz", "generate quiz", "create quiz")):
+        return generate_quiz(text_content, llm, doc_hash, stream=stream, partial=partial)
+    elif command.startswith(("/summary", "generate summary", "summarize")):
+        return generate_summary(text_content, llm, doc_hash, stream=stream)
+    else:
+        return answer_question(command, text_content, llm, vectorstore, chat_history, doc_hash, stream=stream)
+
+
+def quiz_questions(text_content, llm, doc_hash=None, force=False, count=QUIZ_SIZE, partial=False):
+    """
+    Yield validated quiz questions ({"question", "options", "answer"}) as
+    they are generated, or from the document's question bank.
+    partial=True (text of a document still being processed) bypasses the bank,
+    which only holds questions about whole documents.
+    """
+    metrics.new_trace()
+    # A TextHandle is only read into memory for the duration of the quiz
+    return iter_quiz(
+        llm, as_text(text_content), doc_hash, count=count, bank=None if partial else get_question_bank(),
+        cache=get_response_cache(), force=force,
+    )
+
+
+def generate_quiz(text_content, llm, doc_hash=None, force=False, stream=False, partial=False):
+    """
+    Quiz as "Qn: / A. ... <-- correct" text, e.g. for the chat.
+    With stream=True a generator of one text piece per question is returned.
+    """
+    pieces = (
+        ("\n\n" if number > 1 else "") + format_question(number, question)
+        for number, question in enumerate(quiz_questions(text_content, llm, doc_hash, force, partial=partial), 1)
+    )
+    return pieces if stream else "".join(pieces)
+
+
+def generate_summary(text_content, llm, doc_hash=None, force=False, stream=False):
+    summary_prompt = PromptTemplate(
+        template=(
+            "Generate a comprehensive summary of the following content. Include:\n"
+            "1. Key concepts and main ideas\n"
+            "2. Important formulas and equations (presented in LaTeX format between $$ symbols)\n"
+            "3. Critical relationships and dependencies\n"
+            "4. Practical applications or examples mentioned\n\n"
+            "Structure the summary with clear sections and bullet points.\n\n"
+            "Content:\n{text}"
+        ),
+        input_variables=["text"]
+    )
+    metrics.new_trace()
+    return map_reduce(
+        llm, as_text(text_content), SUMMARY_MAP_PROMPT, summary_prompt, task="summary",
+        cache=get_response_cache(), doc_hash=doc_hash, force=force, stream=stream
+    )
+
+
+def answer_question(question, text_content, llm, vectorstore, chat_history=None, doc_hash=None,
+                    stream=False):
+    """
+    Answer user question with context from document and chat history.
+    chat_history may be a ConversationMemory or a plain list of messages.
+    """
+    metrics.new_trace()
+    # Recent turns within the token budget, older ones as a rolling summary
+    history_context = as_memory(chat_history).render()
+    
+    # Get document context
+    if vectorstore:
+        with metrics.span("retrieve") as span:
+            related_docs = vectorstore.invoke(question)
+            span["chunks"] = len(related_docs)
+        # Each chunk is labelled with its source document and page for citations
+        context = format_context(related_docs)
+    else:
+        # Slicing a TextHandle only reads the start of the text
+        context = text_content[:8000]
+    
+    # Create prompt with history and document context
+    qa_prompt = PromptTemplate(
+        template=(
+            "Use the following conversation history and document context to answer the question.\n\n"
+            "CONVERSATION HISTORY:\n{history}\n\n"
+            "DOCUMENT CONTEXT:\n{context}\n\n"
+            "QUESTION: {question}\n\n"
+            "Answer in detail with relevant formulas in LaTeX format ($$...$$). "
+            "When the context labels its sources in square brackets, cite the ones you use "
+            "the same way, e.g. [notes.pdf p.3]. "
+            "If unsure, say you don't know."
+        ),
+        input_variables=["history", "context", "question"]
+    )
+    
+    formatted_prompt = qa_prompt.format(
+        history=history_context,
+        context=context,
+        question=question
+    )
+    
+    if stream:
+        return get_response_cache().stream(llm, formatted_prompt, "answer", doc_hash)
+    return get_response_cache().invoke(llm, formatted_prompt, "answer", doc_hash)
@@ -0,0 +1,265 @@
+"""
+Streaming, per-page hybrid text extraction.
+
+Pages are read from the PDF text layer where it exists and OCR'd only when
+they are empty or nearly empty. Results are yielded one page at a time and
+cached by a fingerprint of the page content, so re-uploading a lightly
+edited PDF only re-extracts the pages that changed.
+"""
+import hashlib
+import os
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+import pdfplumber
+from pdfminer.pdftypes import PDFObjRef, PDFStream, resolve1
+
+from study_assistant import metrics
+from study_assistant.ocr import ocr_pages
+
+# Pages with fewer characters than this in their text layer are OCR'd
+OCR_MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", "40"))
+
+TEXT_LAYER = "text"
+OCR = "ocr"
+
+
+# Fonts used for typeset maths (TeX Computer Modern, AMS, STIX, Cambria Math, ...)
+MATH_FONT = re.compile(r"CMMI|CMSY|CMEX|MSAM|MSBM|Math|Symbol|STIX|rsfs|esint", re.IGNORECASE)
+
+HEADING = "heading"
+EQUATION = "equation"
+TABLE = "table"
+PARAGRAPH = "paragraph"
+
+
+@dataclass
+class PageRecord:
+    number: int
+    text: str
+    source: str
+    fingerprint: str = None
+    # (first_line, last_line, kind, level) spans over text.split("\n") for the
+    # lines that are not plain body text; None when no layout is known (OCR)
+    layout: tuple = None
+
+
+def needs_ocr(page_text):
+    return len((page_text or "").strip()) < OCR_MIN_PAGE_CHARS
+
+
+def _stream_bytes(stream):
+    stream = resolve1(stream)
+    data = getattr(stream, "rawdata", None) or getattr(stream, "data", None)
+    if data is None:
+        data = stream.get_data()
+    return data or b""
+
+
+def _object_digest(obj, memo, resolving=frozenset()):
+    # Digest of a PDF object with every reference, dict, array and stream resolved
+    if isinstance(obj, PDFObjRef):
+        if obj.objid in memo:
+            return memo[obj.objid]
+        if obj.objid in resolving:
+            return b"cycle"
+        value = _object_digest(obj.resolve(), memo, resolving | {obj.objid})
+        memo[obj.objid] = value
+        return value
+    digest = hashlib.sha256()
+    if isinstance(obj, PDFStream):
+        digest.update(b"stream")
+        digest.update(_object_digest(obj.attrs, memo, resolving))
+        digest.update(_stream_bytes(obj))
+    elif isinstance(obj, dict):
+        digest.update(b"dict")
+        for key in sorted(obj, key=str):
+            digest.update(repr(key).encode())
+            digest.update(_object_digest(obj[key], memo, resolving))
+    elif isinstance(obj, (list, tuple)):
+        digest.update(b"array")
+        for item in obj:
+            digest.update(_object_digest(item, memo, resolving))
+    else:
+        digest.update(repr(obj).encode())
+    return digest.digest()
+
+
+def page_fingerprint(page, memo=None):
+    """
+    Hash of a page's raw content streams and its resolved /Resources (form
+    XObjects, images, fonts and their encodings), so two pages only match if
+    they would render the same text. The page cache is shared across
+    documents, so anything the content streams only refer to by name counts.
+
+    Cheap compared to text extraction or OCR; `memo` (one dict per PDF)
+    keeps fonts and forms shared between pages from being hashed again.
+    Returns None when the page structure can't be read, in which case the
+    page is simply not cached.
+    """
+    try:
+        memo = {} if memo is None else memo
+        digest = hashlib.sha256()
+        digest.update(repr((page.width, page.height, page.page_obj.attrs.get("Rotate"))).encode())
+        for stream in page.page_obj.contents or []:
+            digest.update(_stream_bytes(stream))
+        digest.update(_object_digest(page.page_obj.resources, memo))
+        return digest.hexdigest()
+    except Exception:
+        return None
+
+
+def _line_font(chars):
+    # Dominant (size, bold, math fraction) of a text line
+    sizes = Counter(round(char["size"], 1) for char in chars if not char["text"].isspace())
+    if not sizes:
+        return 0.0, False, 0.0
+    fonts = [char.get("fontname", "").split("+")[-1] for char in chars if not char["text"].isspace()]
+    bold = sum("bold" in font.lower() or "black" in font.lower() for font in fonts) > len(fonts) / 2
+    math = sum(bool(MATH_FONT.search(font)) for font in fonts) / len(fonts)
+    return sizes.most_common(1)[0][0], bold, math
+
+
+def page_layout(page):
+    """
+    (text, layout) for a text-layer page.
+
+    `text` is what page.extract_text() returns; `layout` marks headings (by
+    font size or an all-bold short line, relative to the page's body size),
+    display equations (maths fonts), ruled tables and paragraph starts (a
+    vertical gap between lines), in a single pass over the page's lines.
+    """
+    lines = page.extract_text_lines(return_chars=True)
+    text = "\n".join(line["text"] for line in lines)
+    if not lines:
+        return text, ()
+
+    fonts = [_line_font(line["chars"]) for line in lines]
+    body_sizes = Counter()
+    for line, (size, _, _) in zip(lines, fonts):
+        body_sizes[size] += len(line["text"])
+    body = body_sizes.most_common(1)[0][0] or 1.0
+
+    table_boxes = []
+    # Table detection is comparatively slow, so only pages with ruling lines pay for it
+    if page.rects or page.lines:
+        table_boxes = [table.bbox for table in page.find_tables()]
+
+    spans = []
+    previous_bottom = None
+    heights = sorted(line["bottom"] - line["top"] for line in lines)
+    line_height = heights[len(heights) // 2] or 1.0
+    for index, (line, (size, bold, math)) in enumerate(zip(lines, fonts)):
+        middle = (line["top"] + line["bottom"]) / 2
+        stripped = line["text"].strip()
+        if any(line["x0"] < x1 and line["x1"] > x0 and top <= middle <= bottom
+               for x0, top, x1, bottom in table_boxes):
+            kind, level = TABLE, 0
+        elif math >= 0.3:
+            kind, level = EQUATION, 0
+        elif len(stripped) <= 120 and any(c.isalpha() for c in stripped) and size >= body * 1.15:
+            kind, level = HEADING, 1 if size >= body * 1.5 else 2
+        elif bold and len(stripped) <= 80 and not stripped.endswith((".", ",", ";")) and size >= body:
+            kind, level = HEADING, 3
+        elif previous_bottom is not None and line["top"] - previous_bottom > line_height * 0.8:
+            kind, level = PARAGRAPH, 0
+        else:
+            kind = None
+        previous_bottom = line["bottom"]
+        if kind is None:
+            continue
+        # Consecutive lines of one table, equation or multi-line heading form one span
+        if spans and kind != PARAGRAPH and spans[-1][1] == index - 1 and spans[-1][2:] == (kind, level):
+            spans[-1] = (spans[-1][0], index, kind, level)
+        else:
+            spans.append((index, index, kind, level))
+    return text, tuple(spans)
+
+
+def _close_page(page):
+    # Drop pdfplumber's per-page object caches so memory stays flat on long PDFs
+    if hasattr(page, "close"):
+        page.close()
+
+
+def iter_page_records(pdf_path, page_cache=None, on_ocr_start=None, on_ocr_progress=None):
+    """
+    Yield a PageRecord for every page of the PDF.
+
+    Text-layer and cached pages are yielded as soon as they are read; pages
+    that need OCR follow, in page order, as the OCR workers finish them.
+    `on_ocr_start(page_count)` is called once before OCR starts, only if some
+    pages need it; `on_ocr_progress(done, total)` after each OCR'd page.
+    """
+    ocr_needed = {}
+    # Only time spent here counts, not the consumer's work between yields
+    elapsed = 0.0
+    text_pages = cached_pages = text_bytes = 0
+    start = time.perf_counter()
+    with pdfplumber.open(pdf_path) as pdf:
+        # Digests of objects shared between pages (fonts, forms), for this PDF only
+        memo = {}
+        for page_number, page in enumerate(pdf.pages, start=1):
+            fingerprint = page_fingerprint(page, memo)
+            cached = page_cache.get(fingerprint) if page_cache is not None and fingerprint else None
+            if cached is not None:
+                _close_page(page)
+                cached_pages += 1
+                elapsed += time.perf_counter() - start
+                yield PageRecord(page_number, cached.text, cached.source, fingerprint, cached.layout)
+                start = time.perf_counter()
+                continue
+
+            page_text, layout = page_layout(page)
+            _close_page(page)
+            if needs_ocr(page_text):
+                ocr_needed[page_number] = (page_text, fingerprint)
+                continue
+
+            record = PageRecord(page_number, page_text, TEXT_LAYER, fingerprint, layout)
+            if page_cache is not None and fingerprint:
+                page_cache.put(fingerprint, record)
+            text_pages += 1
+            text_bytes += len(page_text)
+            elapsed += time.perf_counter() - start
+            yield record
+            start = time.perf_counter()
+    elapsed += time.perf_counter() - start
+    metrics.record(
+        "extract_text", elapsed, pages=text_pages, cached_pages=cached_pages, bytes=text_bytes,
+        file_bytes=os.path.getsize(pdf_path),
+    )
+    if cached_pages:
+        metrics.cache_event("page", True, cached_pages)
+    if text_pages or ocr_needed:
+        metrics.cache_event("page", False, text_pages + len(ocr_needed))
+
+    if not ocr_needed:
+        return
+    if on_ocr_start:
+        on_ocr_start(len(ocr_needed))
+    # OCR runs in worker processes alongside the consumer, so this is wall time
+    ocr_start = time.perf_counter()
+    ocr_bytes = 0
+    for page_number, ocr_text in ocr_pages(pdf_path, ocr_needed, on_progress=on_ocr_progress):
+        layer_text, fingerprint = ocr_needed[page_number]
+        # Keep whatever the text layer had if OCR found even less
+        if len(ocr_text.strip()) > len(layer_text.strip()):
+            record = PageRecord(page_number, ocr_text, OCR, fingerprint)
+        else:
+            record = PageRecord(page_number, layer_text, TEXT_LAYER, fingerprint)
+        if page_cache is not None and fingerprint:
+            page_cache.put(fingerprint, record)
+        ocr_bytes += len(record.text)
+        yield record
+    metrics.record("ocr", time.perf_counter() - ocr_start, pages=len(ocr_needed), bytes=ocr_bytes)
+
+
+def join_pages(records):
+    """
+    Full document text from page records, in page order.
+    """
+    ordered = sorted(records, key=lambda record: record.number)
+    return "\n\n".join(record.text for record in ordered if record.text.strip())
@@ -0,0 +1,213 @@
+"""
+On-disk store of FAISS indexes, shared by restarts and replicas.
+
+Each entry lives in its own directory named after a key derived from the
+document hash, the embedding model and the chunking parameters:
+
+    <root>/<key>/index.faiss   FAISS index (loaded memory-mapped)
+    <root>/<key>/index.pkl     docstore + id mapping, as written by FAISS.save_local
+    <root>/<key>/text.txt      extracted document text
+    <root>/<key>/meta.json     key parameters, size and last-used timestamp
+
+Admin CLI:
+
+    python -m study_assistant.index_store list
+    python -m study_assistant.index_store prune --older-than 30
+    python -m study_assistant.index_store cap --max-mb 2048
+"""
+import argparse
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from study_assistant.cache import content_hash
+
+DEFAULT_ROOT = os.getenv("INDEX_STORE_DIR", ".index_store")
+
+
+def load_faiss(path, embedding, mmap=True):
+    """
+    Load a directory written by FAISS.save_local. With `mmap=True` the index
+    is memory-mapped read-only, so processes share the OS page cache.
+    """
+    # Imported lazily so the admin CLI does not need faiss/langchain
+    import faiss
+    from langchain_community.vectorstores import FAISS
+
+    path = Path(path)
+    flags = 0
+    if mmap:
+        flags = faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    index = faiss.read_index(str(path / "index.faiss"), flags)
+    with open(path / "index.pkl", "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(
+        embedding_function=embedding,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
+
+
+def _dir_size(path):
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+class IndexStore:
+    def __init__(self, root=DEFAULT_ROOT, max_bytes=None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(doc_hash, model, chunk_size, chunk_overlap, chunker="recursive"):
+        # Keys of indexes built by the original character splitter are unchanged
+        suffix = "" if chunker == "recursive" else f"|{chunker}"
+        return content_hash(f"{doc_hash}|{model}|{chunk_size}|{chunk_overlap}{suffix}")[:32]
+
+    def _path(self, key):
+        return self.root / key
+
+    def __contains__(self, key):
+        return (self._path(key) / "meta.json").exists()
+
+    def load(self, key, embedding, with_text=True):
+        """
+        Return (vectorstore, text) for a stored entry, or None if it is missing.
+        The FAISS index is memory-mapped so replicas share the page cache.
+        With with_text=False the text is not read and None is returned for it.
+        """
+        path = self._path(key)
+        if key not in self:
+            return None
+
+        try:
+            vectorstore = load_faiss(path, embedding)
+            text = (path / "text.txt").read_text(encoding="utf-8") if with_text else None
+        except (OSError, RuntimeError, pickle.UnpicklingError, EOFError):
+            # Half-written or corrupted entry: drop it and rebuild
+            self.remove(key)
+            return None
+
+        self._touch(key)
+        return vectorstore, text
+
+    def save(self, key, vectorstore, text, **params):
+        # `text` is a str or a file-backed TextHandle, which is copied without being read in
+        # Write into a temp dir and rename so readers never see partial entries
+        tmp_dir = Path(tempfile.mkdtemp(prefix=f".{key}-", dir=self.root))
+        try:
+            vectorstore.save_local(str(tmp_dir))
+            if isinstance(text, str):
+                (tmp_dir / "text.txt").write_text(text, encoding="utf-8")
+            else:
+                shutil.copyfile(text.path, tmp_dir / "text.txt")
+            now = time.time()
+            meta = dict(params, key=key, created=now, last_used=now, chunks=vectorstore.index.ntotal)
+            meta["bytes"] = _dir_size(tmp_dir)
+            (tmp_dir / "meta.json").write_text(json.dumps(meta), encoding="utf-8")
+
+            target = self._path(key)
+            if target.exists():
+                shutil.rmtree(target, ignore_errors=True)
+            os.replace(tmp_dir, target)
+        finally:
+            if tmp_dir.exists():
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        if self.max_bytes is not None:
+            self.cap(self.max_bytes)
+
+    def _touch(self, key):
+        meta_path = self._path(key) / "meta.json"
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            meta["last_used"] = time.time()
+            meta_path.write_text(json.dumps(meta), encoding="utf-8")
+        except (OSError, ValueError):
+            pass
+
+    def entries(self):
+        """
+        Metadata of every stored entry, most recently used first.
+        """
+        entries = []
+        for meta_path in self.root.glob("*/meta.json"):
+            try:
+                entries.append(json.loads(meta_path.read_text(encoding="utf-8")))
+            except (OSError, ValueError):
+                continue
+        return sorted(entries, key=lambda meta: meta.get("last_used", 0), reverse=True)
+
+    def total_bytes(self):
+        return sum(meta.get("bytes", 0) for meta in self.entries())
+
+    def remove(self, key):
+        shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def prune(self, older_than_days):
+        """
+        Remove entries not used in the last `older_than_days` days.
+        """
+        cutoff = time.time() - older_than_days * 86400
+        removed = [meta for meta in self.entries() if meta.get("last_used", 0) < cutoff]
+        for meta in removed:
+            self.remove(meta["key"])
+        return removed
+
+    def cap(self, max_bytes):
+        """
+        Remove least recently used entries until the store fits in `max_bytes`.
+        """
+        entries = self.entries()
+        total = sum(meta.get("bytes", 0) for meta in entries)
+        removed = []
+        while entries and total > max_bytes:
+            meta = entries.pop()
+            self.remove(meta["key"])
+            total -= meta.get("bytes", 0)
+            removed.append(meta)
+        return removed
+
+
+def _format_mb(num_bytes):
+    return f"{num_bytes / (1024 * 1024):.1f} MB"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the on-disk FAISS index store")
+    parser.add_argument("--root", default=DEFAULT_ROOT, help="store directory (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list stored indexes")
+    prune_parser = commands.add_parser("prune", help="remove indexes not used recently")
+    prune_parser.add_argument("--older-than", type=float, required=True, metavar="DAYS")
+    cap_parser = commands.add_parser("cap", help="evict least recently used indexes above a size cap")
+    cap_parser.add_argument("--max-mb", type=float, required=True)
+    args = parser.parse_args(argv)
+
+    store = IndexStore(args.root)
+    if args.command == "list":
+        entries = store.entries()
+        for meta in entries:
+            last_used = time.strftime("%Y-%m-%d %H:%M", time.localtime(meta.get("last_used", 0)))
+            print(
+                f"{meta['key']}  {_format_mb(meta.get('bytes', 0)):>10}  {meta.get('chunks', '?'):>6} chunks  "
+                f"{last_used}  {meta.get('model', '?')}  {meta.get('name', '')}"
+            )
+        print(f"{len(entries)} indexes, {_format_mb(sum(m.get('bytes', 0) for m in entries))} total")
+        return
+
+    if args.command == "prune":
+        removed = store.prune(args.older_than)
+    else:
+        removed = store.cap(int(args.max_mb * 1024 * 1024))
+    freed = sum(meta.get("bytes", 0) for meta in removed)
+    print(f"Removed {len(removed)} indexes, freed {_format_mb(freed)}")
+
+
+if __name__ == "__main__":
+    main()
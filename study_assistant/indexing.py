@@ -0,0 +1,98 @@
+"""
+Incremental indexing: page records are split and embedded in small batches
+as extraction produces them, instead of after the whole PDF is read.
+"""
+import os
+from contextlib import nullcontext
+
+from langchain_community.vectorstores import FAISS
+
+from study_assistant import metrics
+
+INDEX_BATCH_PAGES = int(os.getenv("INDEX_BATCH_PAGES", "8"))
+
+
+def split_batch(splitter, records, metadata=None, final=False):
+    """
+    Chunks of one batch of PageRecord, as index_pages() splits them; with
+    final=True a StructuredChunker also returns the section it held back.
+    """
+    if hasattr(splitter, "feed"):
+        documents = splitter.feed(records, metadata or {})
+        return documents + splitter.finish() if final else documents
+    pages = [record for record in records if record.text.strip()]
+    return splitter.create_documents(
+        [record.text for record in pages],
+        metadatas=[dict(metadata or {}, page=record.number, source=record.source) for record in pages],
+    )
+
+
+def index_pages(records, embedding, splitter, batch_pages=INDEX_BATCH_PAGES, on_batch=None,
+                metadata=None, lock=None):
+    """
+    Split and embed `records` (an iterable of PageRecord) batch by batch.
+
+    `splitter` is a StructuredChunker (fed page by page; it may hold a
+    section back until a later batch) or any LangChain text splitter (each
+    page split on its own). Chunks carry their page number in
+    `metadata["page"]`, plus any keys of `metadata`. `on_batch(vectorstore,
+    pages_done)` is called after every batch with the partial index. If
+    `lock` is given, it is held while a batch is added to the index (but not
+    while it is embedded), so the partial index can be searched meanwhile.
+    The first chunks are embedded right away so a partial index exists early;
+    after that, chunks are collected across batches until they fill
+    `embedding.batch_size * embedding.max_concurrency`, so the embedding
+    requests run concurrently instead of one small request per batch.
+    Pages are not kept once they are split; callers that need the text tap
+    `records` (e.g. into a PageSpool). Returns (vectorstore, page_count);
+    the vectorstore is None if no page had text.
+    """
+    vectorstore = None
+    page_count = 0
+    batch = []
+    pending = []  # split but not yet embedded
+    embed_target = getattr(embedding, "batch_size", 1) * getattr(embedding, "max_concurrency", 1)
+
+    def flush(final=False):
+        nonlocal vectorstore
+        records_in_batch = list(batch)
+        batch.clear()
+        if not records_in_batch and not final:
+            return
+        with metrics.span("split", pages=sum(bool(record.text.strip()) for record in records_in_batch)) as split:
+            documents = split_batch(splitter, records_in_batch, metadata, final)
+            split["chunks"] = len(documents)
+        pending.extend(documents)
+        if not pending or (vectorstore is not None and len(pending) < embed_target and not final):
+            return
+        documents = list(pending)
+        pending.clear()
+        texts = [document.page_content for document in documents]
+        text_embeddings = list(zip(texts, embedding.embed_documents(texts)))
+        metadatas = [document.metadata for document in documents]
+        with lock or nullcontext():
+            with metrics.span("faiss_add", chunks=len(documents)):
+                if vectorstore is None:
+                    vectorstore = FAISS.from_embeddings(text_embeddings, embedding, metadatas=metadatas)
+                else:
+                    vectorstore.add_embeddings(text_embeddings, metadatas=metadatas)
+        if on_batch:
+            on_batch(vectorstore, page_count)
+
+    for record in records:
+        page_count += 1
+        batch.append(record)
+        if len(batch) >= batch_pages:
+            flush()
+    flush(final=True)
+    return vectorstore, page_count
+
+
+def vectorstore_chunks(vectorstore):
+    """
+    Chunk texts of a FAISS vectorstore, in index order.
+    """
+    return [
+        vectorstore.docstore.search(doc_id).page_content
+        for doc_id in vectorstore.index_to_docstore_id.values()
+    ]
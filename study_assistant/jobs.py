@@ -0,0 +1,262 @@
+"""
+Background ingestion jobs.
+
+Uploads are processed by a process-wide worker pool instead of inside the
+Streamlit script, so a session returns immediately, a browser refresh does
+not kill the work, and concurrent uploads of the same file share one job.
+Jobs report per-stage progress and expose a searchable partial index while
+they run, so chat can start before the whole PDF is indexed.
+
+The job table is kept in memory and, if `db_path` is set, mirrored to
+SQLite so other processes (and the next start) can see what ran.
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from study_assistant.extract import OCR
+from study_assistant.retrieval import BM25Index, HybridRetriever
+from study_assistant.text_store import PageSpool
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+JOB_DB_PATH = os.getenv("JOB_DB_PATH")  # unset: no persistent job table
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", "256"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+INTERRUPTED = "interrupted"
+
+_PERSISTED_FIELDS = (
+    "job_id", "key", "name", "status", "stage", "pages_total", "pages_extracted", "pages_indexed",
+    "ocr_done", "ocr_total", "chunks", "error", "created", "updated",
+)
+
+
+class LockedVectorStore:
+    """
+    Search-only view of a vectorstore that is still being written to.
+    """
+
+    def __init__(self, vectorstore, lock):
+        self.vectorstore = vectorstore
+        self.lock = lock
+
+    def similarity_search_with_score(self, *args, **kwargs):
+        with self.lock:
+            return self.vectorstore.similarity_search_with_score(*args, **kwargs)
+
+
+class Job:
+    """
+    One ingestion run. Progress fields are written by the worker thread and
+    read by any number of sessions; `result` is set once the job is done.
+    """
+
+    def __init__(self, key, name, on_change=None):
+        self.job_id = uuid.uuid4().hex
+        self.key = key
+        self.name = name
+        self.status = QUEUED
+        self.stage = QUEUED
+        self.pages_total = 0
+        self.pages_extracted = 0
+        self.pages_indexed = 0
+        self.ocr_done = 0
+        self.ocr_total = 0
+        self.chunks = 0
+        self.error = None
+        self.result = None
+        self.created = self.updated = time.time()
+        # Held while a batch is merged into the partial index
+        self.lock = threading.Lock()
+        # Extracted page text, on disk, for summaries and quizzes on the partial document
+        self._pages = PageSpool()
+        self._vectorstore = None
+        self._bm25 = BM25Index()
+        self._on_change = on_change
+        self._done = threading.Event()
+        self._persisted = 0.0
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, INTERRUPTED)
+
+    def update(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.updated = time.time()
+        if self._on_change is not None:
+            self._on_change(self)
+
+    def progress(self):
+        """
+        Fraction of the current stage that is complete.
+        """
+        if self.stage == "ocr" and self.ocr_total:
+            return self.ocr_done / self.ocr_total
+        if self.pages_total:
+            return min(1.0, self.pages_indexed / self.pages_total)
+        return 0.0
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.result
+
+    # Callbacks for the extraction and indexing pipeline
+    def on_page(self, record):
+        self._pages.add(record)
+        self.update(stage="ocr" if record.source == OCR else "extracting",
+                    pages_extracted=self.pages_extracted + 1)
+
+    def on_ocr_start(self, page_count):
+        self.update(stage="ocr", ocr_total=page_count)
+
+    def on_ocr_progress(self, done, total):
+        self.update(ocr_done=done, ocr_total=total)
+
+    def on_batch(self, vectorstore, pages_done):
+        with self.lock:
+            new_documents = [
+                vectorstore.docstore.search(doc_id)
+                for position, doc_id in vectorstore.index_to_docstore_id.items()
+                if position >= len(self._bm25)
+            ]
+            self._vectorstore = vectorstore
+        self._bm25.add_documents(new_documents)
+        self.update(stage="indexing", pages_indexed=pages_done, chunks=vectorstore.index.ntotal)
+
+    def partial(self, **retriever_kwargs):
+        """
+        (text, retriever) over the pages indexed so far, or None before the
+        first batch lands.
+        """
+        with self.lock:
+            vectorstore = self._vectorstore
+        if vectorstore is None:
+            return None
+        retriever = HybridRetriever(LockedVectorStore(vectorstore, self.lock), self._bm25, **retriever_kwargs)
+        # Read from the spool only when a summary or quiz actually needs the text
+        return self._pages.handle(), retriever
+
+    def _release(self):
+        # Partial index and pages are only needed while the job runs
+        with self.lock:
+            # Handles still held by sessions keep the old spool open until they are dropped
+            self._pages = PageSpool()
+            self._vectorstore = None
+            self._bm25 = BM25Index()
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in _PERSISTED_FIELDS}
+
+
+class JobQueue:
+    """
+    Runs jobs on a thread pool; jobs are deduplicated by `key` (e.g. the
+    document hash) while they are queued, running or remembered as finished.
+    """
+
+    def __init__(self, workers=INGEST_WORKERS, db_path=JOB_DB_PATH, history_size=JOB_HISTORY_SIZE):
+        self.history_size = history_size
+        self._jobs = OrderedDict()  # key -> Job
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self._conn = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY, key TEXT, name TEXT, status TEXT, stage TEXT,"
+                " pages_total INTEGER, pages_extracted INTEGER, pages_indexed INTEGER,"
+                " ocr_done INTEGER, ocr_total INTEGER, chunks INTEGER, error TEXT,"
+                " created REAL, updated REAL)"
+            )
+            # Work that was in flight when the previous process died
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, stage = ? WHERE status IN (?, ?)",
+                (INTERRUPTED, INTERRUPTED, QUEUED, RUNNING),
+            )
+            self._conn.commit()
+
+    def __contains__(self, key):
+        return key in self._jobs
+
+    def get(self, key):
+        return self._jobs.get(key)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def submit(self, key, name, run, retry=False):
+        """
+        Queue `run(job)` unless a job with the same key exists; returns the
+        job. Finished jobs are only re-run with retry=True.
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and not (retry and job.finished):
+                return job
+            job = Job(key, name, on_change=self._persist)
+            self._jobs[key] = job
+            self._jobs.move_to_end(key)
+            self._trim()
+        self._persist(job)
+        self._executor.submit(self._run, job, run)
+        return job
+
+    def _trim(self):
+        finished = [key for key, job in self._jobs.items() if job.finished]
+        for key in finished[:max(0, len(self._jobs) - self.history_size)]:
+            del self._jobs[key]
+
+    def _run(self, job, run):
+        job.update(status=RUNNING, stage="starting")
+        try:
+            result = run(job)
+        except Exception as e:
+            job.update(status=FAILED, stage=FAILED, error=str(e))
+        else:
+            job.result = result
+            job.update(status=DONE, stage=DONE)
+        finally:
+            job._release()
+            job._done.set()
+
+    def _persist(self, job):
+        if self._conn is None:
+            return
+        # Progress ticks are written at most once a second; state changes always
+        if job.status == RUNNING and job.stage != "starting" and time.time() - job._persisted < 1.0:
+            return
+        job._persisted = time.time()
+        row = job.as_dict()
+        with self._db_lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO jobs ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                tuple(row.values()),
+            )
+            self._conn.commit()
+
+    def history(self, limit=50):
+        """
+        Most recent jobs from the persistent table (or from memory without one).
+        """
+        if self._conn is None:
+            return [job.as_dict() for job in reversed(self.jobs())][:limit]
+        with self._db_lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_PERSISTED_FIELDS)} FROM jobs ORDER BY updated DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(zip(_PERSISTED_FIELDS, row)) for row in rows]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,140 @@
+"""
+Response cache in front of LLM calls.
+
+Entries are keyed by model, temperature, prompt template id, document hash
+and the hash of the final prompt. A small in-memory LRU sits in front of an
+optional SQLite tier that is shared by sessions, restarts and replicas on
+the same disk. Both tiers expire entries after `ttl` seconds.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from study_assistant import metrics
+from study_assistant.cache import LRUCache, content_hash
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite3")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2048"))
+
+
+def llm_id(llm):
+    """
+    Identify an LLM configuration (model and temperature) for cache keys.
+    """
+    model = getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+    return f"{model}@{getattr(llm, 'temperature', '')}"
+
+
+class ResponseCache:
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.memory = LRUCache(max_entries, sizeof=lambda entry: len(entry[0]))
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, template_id TEXT, response TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(llm, template_id, doc_hash, prompt):
+        return content_hash("|".join([llm_id(llm), template_id, doc_hash or "", content_hash(prompt)]))
+
+    def _fresh(self, created):
+        return self.ttl is None or time.time() - created < self.ttl
+
+    def get(self, key):
+        # An empty response (e.g. a stream that produced nothing) is never a hit
+        entry = self.memory.get(key)
+        if entry is not None and entry[0] and self._fresh(entry[1]):
+            self.memory_hits += 1
+            metrics.cache_event("llm_response", True)
+            return entry[0]
+
+        if self._conn is not None:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT response, created FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+            if row is not None and row[0] and self._fresh(row[1]):
+                self.memory.put(key, row)
+                self.disk_hits += 1
+                metrics.cache_event("llm_response", True)
+                return row[0]
+
+        self.misses += 1
+        metrics.cache_event("llm_response", False)
+        return None
+
+    def put(self, key, response, template_id=""):
+        if not response:
+            return
+        created = time.time()
+        self.memory.put(key, (response, created))
+        if self._conn is not None:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, template_id, response, created) VALUES (?, ?, ?, ?)",
+                    (key, template_id, response, created),
+                )
+                self._conn.commit()
+
+    def invoke(self, llm, prompt, template_id, doc_hash=None, force=False):
+        """
+        `llm.invoke(prompt).content`, served from the cache when possible.
+        `force=True` skips the lookup but still stores the fresh response.
+        """
+        key = self.make_key(llm, template_id, doc_hash, prompt)
+        if not force:
+            response = self.get(key)
+            if response is not None:
+                return response
+        response = llm.invoke(prompt).content
+        self.put(key, response, template_id)
+        return response
+
+    def stream(self, llm, prompt, template_id, doc_hash=None, force=False):
+        """
+        Like `invoke`, but yields text pieces as the model produces them.
+        A cache hit is yielded as a single piece. Only complete responses
+        are stored.
+        """
+        key = self.make_key(llm, template_id, doc_hash, prompt)
+        if not force:
+            response = self.get(key)
+            if response is not None:
+                yield response
+                return
+        parts = []
+        for chunk in llm.stream(prompt):
+            if chunk.content:
+                parts.append(chunk.content)
+                yield chunk.content
+        self.put(key, "".join(parts), template_id)
+
+    def purge_expired(self):
+        if self._conn is not None and self.ttl is not None:
+            with self._lock:
+                self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+                self._conn.commit()
+
+    def stats(self):
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "memory_entries": len(self.memory),
+        }
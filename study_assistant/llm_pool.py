@@ -0,0 +1,340 @@
+"""
+Process-wide async LLM client pool.
+
+All LLM traffic in the process goes through one asyncio event loop running
+on a background thread:
+
+- one shared ChatGroq client per (model, temperature), so HTTP connections
+  are reused across sessions;
+- token buckets for requests and (estimated) prompt tokens per minute, so
+  the process stays under the provider rate limit instead of causing 429
+  storms;
+- a request queue served round-robin across users, so one user firing many
+  map-reduce calls can't starve everyone else;
+- per-request timeouts (per chunk for streams) and retries with backoff on
+  rate limits and timeouts;
+- abandoned requests (e.g. a stream the caller stopped reading) are cancelled.
+
+`PooledLLM` is a synchronous facade with `invoke()` / `stream()`, so it drops
+in wherever a chat model was used. Point GROQ_API_BASE at
+`python -m study_assistant.mock_groq` to run against a local mock server.
+"""
+import asyncio
+import atexit
+import os
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+from study_assistant import metrics
+from study_assistant.embeddings import is_rate_limit_error
+from study_assistant.memory import estimate_tokens
+
+LLM_REQUESTS_PER_MIN = float(os.getenv("LLM_REQUESTS_PER_MIN", "30"))
+LLM_TOKENS_PER_MIN = float(os.getenv("LLM_TOKENS_PER_MIN", "0"))  # 0 disables the token bucket
+LLM_BURST = int(os.getenv("LLM_BURST", "5"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+
+_STREAM_END = object()
+
+
+class TokenBucket:
+    """
+    Async token bucket refilled continuously at `rate_per_min`.
+    """
+
+    def __init__(self, rate_per_min, capacity):
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount=1):
+        # Requests larger than the bucket would wait forever; let them drain it instead
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class FairQueue:
+    """
+    Per-user FIFO queues served round-robin. Only used on the pool's loop.
+    """
+
+    def __init__(self):
+        self._queues = OrderedDict()
+        self._available = asyncio.Condition()
+
+    async def put(self, user_id, item):
+        async with self._available:
+            self._queues.setdefault(user_id, deque()).append(item)
+            self._available.notify()
+
+    async def get(self):
+        async with self._available:
+            await self._available.wait_for(lambda: bool(self._queues))
+            user_id, items = next(iter(self._queues.items()))
+            item = items.popleft()
+            # Serve the next user before this one gets another turn
+            del self._queues[user_id]
+            if items:
+                self._queues[user_id] = items
+            return item
+
+    def pending(self):
+        return {user_id: len(items) for user_id, items in self._queues.items()}
+
+
+class _Request:
+    def __init__(self, client, prompt, timeout, on_chunk=None):
+        self.client = client
+        self.prompt = prompt
+        self.timeout = timeout
+        self.on_chunk = on_chunk
+        self.future = None
+        # Captured on the caller's thread; the pool's loop has no trace of its own
+        self.trace_id = metrics.current_trace_id()
+        self.submitted = time.perf_counter()
+        self.completion = []
+        self.usage = None
+
+    def observe(self, message):
+        # Completion text and provider token counts, for token accounting
+        self.completion.append(message.content or "")
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            self.usage = usage
+
+
+class LLMPool:
+    def __init__(self, requests_per_min=LLM_REQUESTS_PER_MIN, tokens_per_min=LLM_TOKENS_PER_MIN,
+                 burst=LLM_BURST, max_concurrency=LLM_MAX_CONCURRENCY, timeout=LLM_TIMEOUT,
+                 max_retries=LLM_MAX_RETRIES, client_factory=None):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._client_factory = client_factory or _groq_client
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "timeouts": 0, "errors": 0}
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-pool", daemon=True)
+        self._thread.start()
+
+        async def setup():
+            self._queue = FairQueue()
+            self._request_bucket = TokenBucket(requests_per_min, burst)
+            self._token_bucket = (
+                TokenBucket(tokens_per_min, tokens_per_min / 6) if tokens_per_min else None
+            )
+            self._workers = [asyncio.ensure_future(self._worker()) for _ in range(max_concurrency)]
+        asyncio.run_coroutine_threadsafe(setup(), self._loop).result()
+
+    def client(self, model, temperature, user_id="default"):
+        """
+        Synchronous chat-model facade bound to one user's queue.
+        """
+        return PooledLLM(self, model, temperature, user_id)
+
+    def _shared_client(self, model, temperature):
+        key = (model, temperature)
+        with self._clients_lock:
+            if key not in self._clients:
+                self._clients[key] = self._client_factory(model, temperature)
+            return self._clients[key]
+
+    def submit(self, user_id, request):
+        """
+        Queue a request from any thread; returns a concurrent.futures.Future.
+        """
+        async def enqueue():
+            request.future = self._loop.create_future()
+            await self._queue.put(user_id, request)
+            return await request.future
+        return asyncio.run_coroutine_threadsafe(enqueue(), self._loop)
+
+    async def _worker(self):
+        while True:
+            request = await self._queue.get()
+            if request.future.done():
+                # Cancelled while it was queued
+                continue
+            task = asyncio.ensure_future(self._run(request))
+            request.future.add_done_callback(lambda future, task=task: future.cancelled() and task.cancel())
+            try:
+                result = await task
+            except asyncio.CancelledError:
+                # The caller gave up on this request; anything else is the pool shutting down
+                if request.future.cancelled():
+                    continue
+                request.future.cancel()
+                raise
+            except BaseException as e:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            else:
+                if not request.future.done():
+                    request.future.set_result(result)
+
+    async def _call(self, request):
+        if request.on_chunk is None:
+            result = await asyncio.wait_for(request.client.ainvoke(request.prompt), request.timeout)
+            request.observe(result)
+            return result
+        # A long answer may stream for longer than the timeout; it bounds each wait for the next chunk
+        chunks = aiter(request.client.astream(request.prompt))
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(anext(chunks), request.timeout)
+                except StopAsyncIteration:
+                    return None
+                request.observe(chunk)
+                request.on_chunk(chunk)
+        finally:
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+
+    async def _run(self, request):
+        queue_wait = time.perf_counter() - request.submitted
+        start = time.perf_counter()
+        status = "ok"
+        attempt = 0
+        try:
+            while True:
+                await self._request_bucket.acquire()
+                if self._token_bucket is not None:
+                    await self._token_bucket.acquire(max(1, len(request.prompt) // 4))
+                self.stats["requests"] += 1
+                try:
+                    return await self._call(request)
+                except Exception as e:
+                    timed_out = isinstance(e, asyncio.TimeoutError)
+                    rate_limited = is_rate_limit_error(e)
+                    self.stats["timeouts" if timed_out else "rate_limited" if rate_limited else "errors"] += 1
+                    # A stream that already produced output can't be replayed transparently
+                    started = getattr(request, "started", False)
+                    if attempt == self.max_retries or started or not (timed_out or rate_limited):
+                        status = "timeout" if timed_out else "rate_limited" if rate_limited else "error"
+                        raise
+                    self.stats["retries"] += 1
+                    request.completion.clear()
+                    delay = 2 ** attempt
+                    attempt += 1
+                    await asyncio.sleep(delay + random.uniform(0, delay / 2))
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            self._record(request, time.perf_counter() - start, queue_wait, attempt, status)
+
+    def _record(self, request, seconds, queue_wait, retries, status):
+        usage = request.usage or {}
+        metrics.record(
+            "llm", seconds, status=status, trace_id=request.trace_id,
+            model=getattr(request.client, "model_name", None),
+            prompt_tokens=usage.get("input_tokens") or estimate_tokens(request.prompt),
+            completion_tokens=usage.get("output_tokens") or estimate_tokens("".join(request.completion)),
+            estimated_tokens=not usage, retries=retries, queue_wait_ms=round(queue_wait * 1000, 2),
+            streamed=request.on_chunk is not None,
+        )
+
+    def pending(self):
+        return asyncio.run_coroutine_threadsafe(self._pending(), self._loop).result()
+
+    async def _pending(self):
+        return self._queue.pending()
+
+    def close(self):
+        if not self._loop.is_running():
+            return
+
+        async def shutdown():
+            for worker in self._workers:
+                worker.cancel()
+            await asyncio.gather(*self._workers, return_exceptions=True)
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+class PooledLLM:
+    """
+    Chat-model stand-in (`invoke`, `stream`, `model_name`, `temperature`)
+    that sends every call through an LLMPool on behalf of one user.
+    """
+
+    def __init__(self, pool, model, temperature, user_id):
+        self.pool = pool
+        self.model_name = model
+        self.temperature = temperature
+        self.user_id = user_id
+
+    def invoke(self, prompt, timeout=None):
+        client = self.pool._shared_client(self.model_name, self.temperature)
+        request = _Request(client, prompt, timeout or self.pool.timeout)
+        return self.pool.submit(self.user_id, request).result()
+
+    def stream(self, prompt, timeout=None):
+        client = self.pool._shared_client(self.model_name, self.temperature)
+        chunks = queue.Queue()
+
+        def on_chunk(chunk):
+            request.started = True
+            chunks.put(chunk)
+
+        request = _Request(client, prompt, timeout or self.pool.timeout, on_chunk=on_chunk)
+        future = self.pool.submit(self.user_id, request)
+        future.add_done_callback(lambda _: chunks.put(_STREAM_END))
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is _STREAM_END:
+                    break
+                yield chunk
+        finally:
+            # A consumer that stops early (closed or garbage-collected generator) frees the pool slot
+            if not future.done():
+                future.cancel()
+        # Surface errors raised by the request
+        future.result()
+
+
+def _groq_client(model, temperature):
+    from langchain_groq import ChatGroq
+
+    # Retries are handled by the pool, which knows about every other request
+    return ChatGroq(
+        model=model, temperature=temperature, groq_api_key=os.getenv("GROQ_API_KEY"),
+        max_retries=0, request_timeout=LLM_TIMEOUT,
+    )
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_llm_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = LLMPool()
+            atexit.register(_pool.close)
+            metrics.register_collector(lambda: [
+                ("llm_queue_depth", {}, sum(_pool.pending().values())),
+                *[("llm_pool_events", {"event": name}, value) for name, value in _pool.stats.items()],
+            ])
+        return _pool
@@ -0,0 +1,123 @@
+"""
+Map-reduce generation over the whole document.
+
+The text is cut into sections at paragraph boundaries. A map prompt runs on
+every section in parallel, and a reduce prompt combines the map outputs into
+one result. All calls go through a ResponseCache; map outputs are always
+reused, so regenerating with `force=True` only re-runs the reduce step.
+"""
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.prompts import PromptTemplate
+
+from study_assistant.llm_cache import ResponseCache
+
+MAP_SECTION_CHARS = int(os.getenv("MAP_SECTION_CHARS", "10000"))
+MAP_MAX_CONCURRENCY = int(os.getenv("MAP_MAX_CONCURRENCY", "4"))
+# Map outputs are collapsed again until they fit in one reduce prompt
+REDUCE_MAX_CHARS = int(os.getenv("REDUCE_MAX_CHARS", "12000"))
+MAX_COLLAPSE_ROUNDS = 3
+
+SUMMARY_MAP_PROMPT = PromptTemplate(
+    template=(
+        "Write concise study notes for the following section of a longer document.\n"
+        "Keep key concepts, definitions, important formulas (in LaTeX between $$ symbols), "
+        "relationships and examples. Do not add an introduction or a conclusion.\n\n"
+        "Section:\n{text}"
+    ),
+    input_variables=["text"]
+)
+
+QUIZ_MAP_PROMPT = PromptTemplate(
+    template=(
+        "List the key concepts, definitions, formulas and facts in the following section "
+        "that would make good conceptual multiple choice questions.\n"
+        "Write one short item per line. Use LaTeX between $ symbols for math.\n\n"
+        "Section:\n{text}"
+    ),
+    input_variables=["text"]
+)
+
+# Used when the caller doesn't pass a cache of its own
+memory_cache = ResponseCache(path=None)
+
+
+def split_sections(text, max_chars=MAP_SECTION_CHARS):
+    """
+    Cut text into sections of at most `max_chars`, preferring paragraph breaks.
+    """
+    sections = []
+    current = []
+    current_len = 0
+    for paragraph in text.split("\n\n"):
+        # Paragraphs longer than a section are hard-split
+        while len(paragraph) > max_chars:
+            if current:
+                sections.append("\n\n".join(current))
+                current, current_len = [], 0
+            sections.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and current_len + len(paragraph) + 2 > max_chars:
+            sections.append("\n\n".join(current))
+            current, current_len = [], 0
+        if paragraph.strip():
+            current.append(paragraph)
+            current_len += len(paragraph) + 2
+    if current:
+        sections.append("\n\n".join(current))
+    return sections
+
+
+def _map(llm, sections, prompt, template_id, cache, doc_hash, max_concurrency):
+    def run(section):
+        return cache.invoke(llm, prompt.format(text=section), template_id, doc_hash)
+
+    # Map calls belong to the caller's trace
+    context = contextvars.copy_context()
+    workers = max(1, min(max_concurrency, len(sections)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda section: context.copy().run(run, section), sections))
+
+
+def condense(llm, text, map_prompt, task, cache=None, doc_hash=None, max_concurrency=MAP_MAX_CONCURRENCY,
+             section_chars=MAP_SECTION_CHARS, reduce_max_chars=REDUCE_MAX_CHARS):
+    """
+    The map half of map_reduce(): `text` itself if it fits in one section,
+    otherwise the map outputs, collapsed until they fit in one reduce prompt.
+    """
+    if cache is None:
+        cache = memory_cache
+    sections = split_sections(text, section_chars)
+    if len(sections) <= 1:
+        return text
+    outputs = _map(llm, sections, map_prompt, f"{task}:map", cache, doc_hash, max_concurrency)
+    joined = "\n\n".join(outputs)
+    # Collapse map outputs until they fit into a single reduce call
+    for _ in range(MAX_COLLAPSE_ROUNDS):
+        groups = split_sections(joined, reduce_max_chars)
+        if len(groups) == 1:
+            break
+        outputs = _map(llm, groups, map_prompt, f"{task}:collapse", cache, doc_hash, max_concurrency)
+        joined = "\n\n".join(outputs)
+    return joined[:reduce_max_chars]
+
+
+def map_reduce(llm, text, map_prompt, reduce_prompt, task, cache=None, doc_hash=None, force=False,
+               stream=False, max_concurrency=MAP_MAX_CONCURRENCY, section_chars=MAP_SECTION_CHARS,
+               reduce_max_chars=REDUCE_MAX_CHARS):
+    """
+    Run `reduce_prompt` over the whole of `text` and return the LLM output.
+
+    `task` is the prompt template id used in cache keys. Text that fits in one
+    section goes straight to the reduce prompt, so short documents still cost
+    a single call. With `stream=True` the map step runs eagerly and a
+    generator of reduce output pieces is returned.
+    """
+    if cache is None:
+        cache = memory_cache
+    text = condense(llm, text, map_prompt, task, cache, doc_hash, max_concurrency, section_chars, reduce_max_chars)
+    if stream:
+        return cache.stream(llm, reduce_prompt.format(text=text), task, doc_hash, force=force)
+    return cache.invoke(llm, reduce_prompt.format(text=text), task, doc_hash, force=force)
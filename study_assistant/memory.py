@@ -0,0 +1,141 @@
+"""
+Token-budgeted conversation memory for the chat.
+
+Messages are added one at a time. The most recent turns are kept verbatim
+while they fit in the token budget; older turns are folded into a rolling
+summary that is refreshed on a background thread. Rendering the history is
+bounded by the budget, not by the length of the conversation.
+"""
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "600"))
+# Share of the budget reserved for the rolling summary of older turns
+SUMMARY_TOKEN_SHARE = 0.25
+
+_summary_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-summary")
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return max(1, len(text) // 4)
+
+
+def format_message(msg):
+    if isinstance(msg, HumanMessage):
+        return f"Human: {msg.content}"
+    if isinstance(msg, AIMessage):
+        return f"AI: {msg.content}"
+    return None
+
+
+def make_llm_summarizer(llm, max_words=150):
+    """
+    Summarizer for ConversationMemory backed by a chat model.
+    """
+    def summarize(summary, lines):
+        prompt = (
+            "You maintain a running summary of a study conversation between a student "
+            "and an assistant about a document.\n"
+            f"Update the summary with the new lines below. Keep it under {max_words} words "
+            "and keep the topics, questions asked and key answers.\n\n"
+            f"CURRENT SUMMARY:\n{summary or '(empty)'}\n\n"
+            "NEW LINES:\n" + "\n".join(lines)
+        )
+        return llm.invoke(prompt).content.strip()
+    return summarize
+
+
+class ConversationMemory:
+    def __init__(self, budget=HISTORY_TOKEN_BUDGET, summarize=None):
+        self.budget = budget
+        self.summary = ""
+        self._summarize = summarize
+        self._recent = deque()  # (line, tokens), oldest first
+        self._recent_tokens = 0
+        self._evicted = []
+        self._refresh = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_messages(cls, messages, **kwargs):
+        memory = cls(**kwargs)
+        for msg in messages or []:
+            memory.add(msg)
+        return memory
+
+    @property
+    def _recent_budget(self):
+        if self.summary or self._evicted:
+            return int(self.budget * (1 - SUMMARY_TOKEN_SHARE))
+        return self.budget
+
+    def add(self, msg):
+        line = format_message(msg)
+        if line is None:
+            return
+        max_chars = self.budget * 4
+        if len(line) > max_chars:
+            line = line[:max_chars] + " ..."
+
+        with self._lock:
+            self._recent.append((line, estimate_tokens(line)))
+            self._recent_tokens += self._recent[-1][1]
+            # Oldest turns leave the verbatim window, newest always stays
+            while len(self._recent) > 1 and self._recent_tokens > self._recent_budget:
+                old_line, tokens = self._recent.popleft()
+                self._recent_tokens -= tokens
+                self._evicted.append(old_line)
+            self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        if not self._evicted or (self._refresh is not None and not self._refresh.done()):
+            return
+        lines, self._evicted = self._evicted, []
+        if self._summarize is None:
+            # No model available: keep the tail of the dropped lines as-is
+            self.summary = "\n".join(([self.summary] if self.summary else []) + lines)
+            self.summary = self.summary[-int(self.budget * SUMMARY_TOKEN_SHARE) * 4:]
+            return
+        self._refresh = _summary_pool.submit(self._run_refresh, self.summary, lines)
+
+    def _run_refresh(self, summary, lines):
+        try:
+            new_summary = self._summarize(summary, lines)
+        except Exception:
+            # Put the lines back so the next refresh retries them
+            with self._lock:
+                self._evicted = lines + self._evicted
+            return
+        with self._lock:
+            self.summary = new_summary
+            # Lines evicted while this refresh was running
+            self._refresh = None
+            self._schedule_refresh()
+
+    def render(self):
+        """
+        History text for the prompt: rolling summary, then recent turns.
+        """
+        with self._lock:
+            recent = [line for line, _ in self._recent]
+            summary = self.summary
+        parts = []
+        if summary:
+            max_chars = int(self.budget * SUMMARY_TOKEN_SHARE) * 4
+            parts.append(f"Summary of earlier conversation: {summary[:max_chars]}")
+        parts.extend(recent)
+        return "\n".join(parts)
+
+
+def as_memory(chat_history):
+    """
+    Accept a ConversationMemory or a plain list of messages.
+    """
+    if isinstance(chat_history, ConversationMemory):
+        return chat_history
+    return ConversationMemory.from_messages(chat_history)
@@ -0,0 +1,249 @@
+"""
+Lightweight tracing and metrics, with no dependencies.
+
+Wrap a stage in `span("embed", chunks=n)` to record its latency and
+attributes. Spans opened inside another span share its trace id, so all
+the stages of one upload or one question can be correlated. Every finished
+span:
+
+- updates Prometheus counters and a latency histogram labelled by stage
+  (numeric attributes such as pages, chunks, bytes and tokens are summed);
+- is logged as one JSON line on the "study_assistant.metrics" logger
+  (METRICS_LOG=json prints them to stderr);
+- is kept in a small ring buffer for the UI debug panel.
+
+`render_prometheus()` returns the text exposition format.
+`start_metrics_server(port)` serves it on /metrics (enabled by METRICS_PORT).
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_LOG = os.getenv("METRICS_LOG", "")  # "json": log every span to stderr
+METRICS_RECENT_SPANS = int(os.getenv("METRICS_RECENT_SPANS", "500"))
+
+PREFIX = "study_assistant"
+# Numeric span attributes that are also exported as per-stage counters
+SUMMED_ATTRIBUTES = ("pages", "chunks", "bytes", "prompt_tokens", "completion_tokens", "retries")
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+logger = logging.getLogger("study_assistant.metrics")
+if METRICS_LOG == "json":
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+_current_trace = contextvars.ContextVar("study_assistant_trace", default=None)
+_lock = threading.Lock()
+_counters = defaultdict(float)  # (name, labels) -> value
+_histograms = {}  # stage -> [bucket counts..., count, sum]
+_recent = deque(maxlen=METRICS_RECENT_SPANS)
+_collectors = []
+
+
+def _labels(**labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """
+    Add `value` to the counter `<PREFIX>_<name>` with the given labels.
+    """
+    with _lock:
+        _counters[(name, _labels(**labels))] += value
+
+
+def cache_event(cache, hit, count=1):
+    inc("cache_requests_total", count, cache=cache, result="hit" if hit else "miss")
+
+
+def current_trace_id():
+    return _current_trace.get()
+
+
+def new_trace():
+    """
+    Start a fresh trace in the current context; the spans and LLM calls that
+    follow (until the next new_trace) share its id.
+    """
+    trace_id = uuid.uuid4().hex[:16]
+    _current_trace.set(trace_id)
+    return trace_id
+
+
+def _observe(stage, seconds):
+    with _lock:
+        buckets = _histograms.setdefault(stage, [0] * (len(BUCKETS) + 2))
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+        buckets[-2] += 1
+        buckets[-1] += seconds
+
+
+def record(stage, seconds, status="ok", trace_id=None, **attrs):
+    """
+    Record a finished stage measured elsewhere (e.g. across threads).
+    """
+    _observe(stage, seconds)
+    inc("stage_total", stage=stage, status=status)
+    for name in SUMMED_ATTRIBUTES:
+        value = attrs.get(name)
+        if isinstance(value, (int, float)) and value:
+            inc(f"{name}_total", value, stage=stage)
+    entry = {
+        "ts": round(time.time(), 3),
+        "trace_id": trace_id or current_trace_id(),
+        "stage": stage,
+        "status": status,
+        "duration_ms": round(seconds * 1000, 2),
+        **attrs,
+    }
+    _recent.append(entry)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(entry, default=str))
+
+
+@contextmanager
+def span(stage, **attrs):
+    """
+    Time the block as `stage`. The yielded dict can be updated with more
+    attributes (counts, cache hits, ...) before the block ends.
+    """
+    trace_id = _current_trace.get()
+    token = None
+    if trace_id is None:
+        trace_id = uuid.uuid4().hex[:16]
+        token = _current_trace.set(trace_id)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield attrs
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        record(stage, time.perf_counter() - start, status=status, trace_id=trace_id, **attrs)
+        if token is not None:
+            _current_trace.reset(token)
+
+
+def register_collector(collect):
+    """
+    `collect()` returns [(name, labels dict, value)] gauges read at scrape
+    time, e.g. cache sizes.
+    """
+    _collectors.append(collect)
+
+
+def recent_spans(limit=50):
+    return list(_recent)[-limit:][::-1]
+
+
+def stage_summary():
+    """
+    Per-stage count, mean and p50/p95 latency (ms) over the recent spans.
+    """
+    durations = defaultdict(list)
+    for entry in list(_recent):
+        durations[entry["stage"]].append(entry["duration_ms"])
+    summary = {}
+    for stage, values in sorted(durations.items()):
+        values.sort()
+        summary[stage] = {
+            "count": len(values),
+            "mean_ms": round(sum(values) / len(values), 2),
+            "p50_ms": values[len(values) // 2],
+            "p95_ms": values[min(len(values) - 1, int(len(values) * 0.95))],
+        }
+    return summary
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def render_prometheus():
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = {stage: list(buckets) for stage, buckets in _histograms.items()}
+
+    declared = set()
+    for (name, labels), value in counters:
+        if name not in declared:
+            lines.append(f"# TYPE {PREFIX}_{name} counter")
+            declared.add(name)
+        lines.append(f"{PREFIX}_{name}{_format_labels(labels)} {value:g}")
+
+    if histograms:
+        lines.append(f"# TYPE {PREFIX}_stage_seconds histogram")
+    for stage, buckets in sorted(histograms.items()):
+        for bound, count in zip(BUCKETS, buckets):
+            lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound:g}"}} {count}')
+        lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {buckets[-2]}')
+        lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {buckets[-2]}')
+        lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {buckets[-1]:g}')
+
+    for collect in list(_collectors):
+        try:
+            samples = collect()
+        except Exception:
+            continue
+        for name, labels, value in samples:
+            if name not in declared:
+                lines.append(f"# TYPE {PREFIX}_{name} gauge")
+                declared.add(name)
+            lines.append(f"{PREFIX}_{name}{_format_labels(_labels(**labels))} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_server = None
+_server_failed = False
+
+
+def start_metrics_server(port=METRICS_PORT, host="0.0.0.0"):
+    """
+    Serve /metrics on a daemon thread; calling it again is a no-op. If the
+    port cannot be bound, a warning is logged once and None is returned from
+    then on, instead of retrying on every Streamlit rerun.
+    """
+    global _server, _server_failed
+    with _lock:
+        if _server is None and port and not _server_failed:
+            try:
+                _server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+            except OSError as e:
+                _server_failed = True
+                logger.warning(f"Metrics server not started on {host}:{port}: {e}")
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return _server
@@ -0,0 +1,120 @@
+"""
+Minimal mock of the Groq chat-completions API for load-testing the LLM pool.
+
+    python -m study_assistant.mock_groq --port 8765 --latency 0.5 --rate 60
+    GROQ_API_BASE=http://127.0.0.1:8765 GROQ_API_KEY=mock streamlit run Study-Assistant.py
+
+Answers every request with a canned completion after `--latency` seconds and
+returns 429 once more than `--rate` requests arrive within a minute, like the
+real API does.
+"""
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = "This is a mock answer from the local Groq stand-in."
+
+
+class MockGroqHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _rate_limited(self):
+        server = self.server
+        with server.lock:
+            now = time.monotonic()
+            while server.recent and now - server.recent[0] > 60:
+                server.recent.popleft()
+            if server.rate and len(server.recent) >= server.rate:
+                server.rejected += 1
+                return True
+            server.recent.append(now)
+            server.served += 1
+            return False
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send_json(404, {"error": {"message": "not found"}})
+        if self._rate_limited():
+            return self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}})
+
+        time.sleep(self.server.latency)
+        model = request.get("model", "mock")
+        created = int(time.time())
+        if not request.get("stream"):
+            return self._send_json(200, {
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": REPLY}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        words = REPLY.split(" ")
+        for i, word in enumerate(words):
+            chunk = {
+                "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": None,
+                             "delta": {"role": "assistant", "content": word + (" " if i < len(words) - 1 else "")}}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        done = {
+            "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}],
+        }
+        self.wfile.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode())
+        self.wfile.flush()
+
+
+def make_server(host="127.0.0.1", port=8765, latency=0.5, rate=0):
+    server = ThreadingHTTPServer((host, port), MockGroqHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.rate = rate
+    server.lock = threading.Lock()
+    server.recent = deque()
+    server.served = 0
+    server.rejected = 0
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local mock of the Groq chat API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds before each reply")
+    parser.add_argument("--rate", type=int, default=0, help="Requests per minute before 429s (0 = unlimited)")
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, args.latency, args.rate)
+    print(f"Mock Groq API on http://{args.host}:{args.port} (latency {args.latency}s, rate {args.rate or 'unlimited'}/min)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
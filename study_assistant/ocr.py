@@ -0,0 +1,87 @@
+"""
+Streaming OCR for scanned PDFs.
+
+Pages are rasterized lazily in small ranges inside worker processes and
+handed to Tesseract as in-memory images, so peak memory depends on the
+number of workers rather than on the page count, and nothing is written
+to the working directory.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytesseract
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0")) or os.cpu_count() or 1
+OCR_PAGES_PER_TASK = int(os.getenv("OCR_PAGES_PER_TASK", "2"))
+
+
+def page_count(pdf_path):
+    return int(pdfinfo_from_path(pdf_path)["Pages"])
+
+
+def _page_ranges(page_numbers, max_len):
+    # Group sorted page numbers into contiguous runs of at most max_len pages
+    ranges = []
+    for page_number in page_numbers:
+        if ranges and page_number == ranges[-1][-1] + 1 and len(ranges[-1]) < max_len:
+            ranges[-1].append(page_number)
+        else:
+            ranges.append([page_number])
+    return ranges
+
+
+def _ocr_range(pdf_path, first_page, last_page, dpi):
+    # Runs in a worker process; only this range is ever rasterized here
+    images = convert_from_path(
+        pdf_path, dpi=dpi, first_page=first_page, last_page=last_page, grayscale=True
+    )
+    texts = []
+    for image in images:
+        try:
+            texts.append(pytesseract.image_to_string(image))
+        finally:
+            image.close()
+    return texts
+
+
+def ocr_pages(pdf_path, page_numbers=None, dpi=OCR_DPI, workers=None, on_progress=None):
+    """
+    OCR `page_numbers` (1-based, default: every page) on a process pool.
+
+    Yields (page_number, text) in page order as soon as each page is ready.
+    `on_progress(done, total)` is called after every page.
+    """
+    if page_numbers is None:
+        page_numbers = range(1, page_count(pdf_path) + 1)
+    page_numbers = sorted(set(page_numbers))
+    if not page_numbers:
+        return
+
+    ranges = _page_ranges(page_numbers, OCR_PAGES_PER_TASK)
+    workers = max(1, min(workers or OCR_WORKERS, len(ranges)))
+    # At most two ranges per worker are in flight, which bounds peak memory
+    max_in_flight = workers * 2
+    total = len(page_numbers)
+    done = 0
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = {}
+        next_range = 0
+        for i, page_range in enumerate(ranges):
+            while next_range < len(ranges) and len(futures) < max_in_flight:
+                submit = ranges[next_range]
+                futures[next_range] = pool.submit(_ocr_range, pdf_path, submit[0], submit[-1], dpi)
+                next_range += 1
+
+            texts = futures.pop(i).result()
+            for page_number, text in zip(page_range, texts):
+                done += 1
+                if on_progress:
+                    on_progress(done, total)
+                yield page_number, text
+    finally:
+        # Also reached when the consumer stops early; don't OCR pages nobody reads
+        pool.shutdown(wait=True, cancel_futures=True)
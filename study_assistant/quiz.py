@@ -0,0 +1,359 @@
+"""
+Structured quiz generation.
+
+The model is asked for JSON questions. Each question is validated on its
+own as it streams in. Only missing or invalid questions are asked for again
+(never the whole quiz), near-duplicates are dropped, and accepted questions
+go to a per-document question bank. Repeat quizzes are then served from the
+bank without calling the model.
+
+The "Q1: ... / A. ... <-- correct" text format is still used to display a
+quiz in chat and is accepted as a fallback when the model ignores the JSON
+instructions.
+"""
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+from langchain_core.prompts import PromptTemplate
+
+from study_assistant.cache import content_hash
+from study_assistant.mapreduce import QUIZ_MAP_PROMPT, condense
+from study_assistant.retrieval import tokenize
+
+QUIZ_SIZE = int(os.getenv("QUIZ_SIZE", "5"))
+QUIZ_MAX_ROUNDS = int(os.getenv("QUIZ_MAX_ROUNDS", "3"))
+QUIZ_DEDUPE_THRESHOLD = float(os.getenv("QUIZ_DEDUPE_THRESHOLD", "0.8"))
+QUIZ_BANK_PATH = os.getenv("QUIZ_BANK_PATH", ".quiz_bank.sqlite3")
+# Most recent known questions listed in the prompt as ones to avoid
+QUIZ_AVOID_MAX = int(os.getenv("QUIZ_AVOID_MAX", "20"))
+
+QUIZ_PROMPT = PromptTemplate(
+    template=(
+        "Write {count} conceptual multiple choice questions about the study material below.\n"
+        "Each question has exactly 4 distinct options and exactly one correct answer.\n"
+        "For mathematical questions, use LaTeX format surrounded by $ symbols.\n"
+        "Do not repeat or rephrase any of these existing questions:\n{avoid}\n\n"
+        "Return only JSON, with no other text, in this form:\n"
+        '{{"questions": [{{"question": "...", "options": ["...", "...", "...", "..."], "answer": 0}}]}}\n'
+        "where \"answer\" is the index (0-3) of the correct option.\n\n"
+        "Material:\n{text}"
+    ),
+    input_variables=["count", "avoid", "text"]
+)
+
+_BLOCK_START = re.compile(r'(?:^|\n)(?=Q\d+:)')
+_CORRECT = re.compile(r'\s*<-- correct\s*')
+_OPTION = re.compile(r'^[A-D]\.\s+')
+
+
+def parse_quiz_block(block):
+    """
+    Parse one "Qn:" block into {"question", "options", "answer"}, or None if
+    it is not a complete multiple choice question.
+    """
+    lines = [line.strip() for line in block.split('\n') if line.strip()]
+    if not lines or not re.match(r'^Q\d+:', lines[0]):
+        return None
+
+    question_text = lines[0].split(':', 1)[1].strip()
+    options = []
+    correct_answer = None
+    for opt in lines[1:]:
+        # Check if this is the correct answer
+        is_correct = '<-- correct' in opt
+        clean_opt = _CORRECT.sub('', opt).strip()
+
+        # Skip if it's not a proper option line
+        if not _OPTION.match(clean_opt):
+            continue
+
+        option_text = clean_opt[2:].strip()  # Remove "A. ", "B. ", etc
+        options.append(option_text)
+        if is_correct:
+            correct_answer = option_text
+
+    if question_text and correct_answer and len(options) >= 4:
+        return {
+            "question": question_text,
+            "options": options[:4],
+            "answer": correct_answer
+        }
+    return None
+
+
+def parse_quiz(quiz_raw):
+    """
+    Parse a complete quiz, dropping malformed questions.
+    """
+    questions = []
+    for block in re.split(r'\n(?=Q\d+:)', quiz_raw.strip()):
+        question = parse_quiz_block(block)
+        if question is not None:
+            questions.append(question)
+    return questions
+
+
+def format_question(number, question):
+    """
+    Render a question in the "Qn: / A. ... <-- correct" text format.
+    """
+    lines = [f"Q{number}: {question['question']}"]
+    for letter, option in zip("ABCD", question["options"]):
+        marker = " <-- correct" if option == question["answer"] else ""
+        lines.append(f"{letter}. {option}{marker}")
+    return "\n".join(lines)
+
+
+# ===============================
+# ✅ Validation & De-duplication
+# ===============================
+_OPTION_PREFIX = re.compile(r'^\(?[A-Da-d][.)]\s+')
+
+
+def validate_question(item):
+    """
+    Normalise one model-produced question to {"question", "options",
+    "answer"}, or return None if it is not a usable multiple choice question.
+    `answer` may be given as an option index, a letter or the option text.
+    """
+    if not isinstance(item, dict):
+        return None
+    question = item.get("question")
+    options = item.get("options")
+    if not isinstance(question, str) or not question.strip():
+        return None
+    if not isinstance(options, list) or len(options) != 4:
+        return None
+    if not all(isinstance(option, str) and option.strip() for option in options):
+        return None
+    options = [_OPTION_PREFIX.sub('', option.strip()) for option in options]
+    if len({option.lower() for option in options}) != 4:
+        return None
+
+    answer = item.get("answer")
+    if isinstance(answer, bool):
+        return None
+    if isinstance(answer, int) and 0 <= answer < 4:
+        answer = options[answer]
+    elif isinstance(answer, str) and answer.strip().upper() in ("A", "B", "C", "D"):
+        answer = options["ABCD".index(answer.strip().upper())]
+    elif isinstance(answer, str):
+        answer = _OPTION_PREFIX.sub('', answer.strip())
+    if answer not in options:
+        return None
+    return {"question": question.strip(), "options": options, "answer": answer}
+
+
+def _terms(question):
+    return set(tokenize(question["question"]))
+
+
+def is_near_duplicate(question, others, threshold=QUIZ_DEDUPE_THRESHOLD):
+    """
+    True if the question stem overlaps (Jaccard on terms) with any of `others`.
+    """
+    terms = _terms(question)
+    for other in others:
+        other_terms = _terms(other)
+        union = terms | other_terms
+        if not union or len(terms & other_terms) / len(union) >= threshold:
+            return True
+    return False
+
+
+# ===============================
+# 📡 Streaming JSON Parsing
+# ===============================
+class QuizStreamParser:
+    """
+    Feed streamed model output in; each question object comes out validated
+    as soon as its closing brace arrives. Invalid objects are counted in
+    `rejected`. If the output contains no JSON objects at all, close() falls
+    back to the "Qn:" text format.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._starts = []  # offsets of the currently open '{'
+        self._in_string = False
+        self._escaped = False
+        self._offset = 0
+        self._objects = 0
+        self.questions = []
+        self.rejected = 0
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    def _emit(self, item):
+        question = validate_question(item)
+        if question is None:
+            self.rejected += 1
+            return []
+        self.questions.append(question)
+        return [question]
+
+    def feed(self, piece):
+        self._parts.append(piece)
+        text = None
+        completed = []
+        for i, char in enumerate(piece, self._offset):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._starts.append(i)
+            elif char == "}" and self._starts:
+                start = self._starts.pop()
+                text = text if text is not None else self.text
+                try:
+                    item = json.loads(text[start:i + 1])
+                except ValueError:
+                    continue
+                self._objects += 1
+                # The wrapping {"questions": [...]} object is not a question itself
+                if isinstance(item, dict) and "question" in item:
+                    completed += self._emit(item)
+        self._offset += len(piece)
+        return completed
+
+    def close(self):
+        if self._objects:
+            return []
+        completed = []
+        for question in parse_quiz(self.text):
+            completed += self._emit(question)
+        return completed
+
+
+# ===============================
+# 🏦 Question Bank
+# ===============================
+class QuestionBank:
+    """
+    Validated questions per document, in SQLite (or in memory with path=None).
+    """
+
+    def __init__(self, path=QUIZ_BANK_PATH):
+        self._lock = threading.Lock()
+        self._memory = {}
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS questions ("
+                " doc_hash TEXT NOT NULL, key TEXT NOT NULL, question TEXT NOT NULL, created REAL NOT NULL,"
+                " PRIMARY KEY (doc_hash, key))"
+            )
+            self._conn.commit()
+
+    def questions(self, doc_hash):
+        with self._lock:
+            if self._conn is None:
+                return list(self._memory.get(doc_hash, []))
+            rows = self._conn.execute(
+                "SELECT question FROM questions WHERE doc_hash = ? ORDER BY created", (doc_hash,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def add(self, doc_hash, questions):
+        with self._lock:
+            if self._conn is None:
+                self._memory.setdefault(doc_hash, []).extend(questions)
+                return
+            now = time.time()
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO questions (doc_hash, key, question, created) VALUES (?, ?, ?, ?)",
+                [
+                    (doc_hash, content_hash(question["question"]), json.dumps(question), now)
+                    for question in questions
+                ],
+            )
+            self._conn.commit()
+
+    def clear(self, doc_hash):
+        with self._lock:
+            self._memory.pop(doc_hash, None)
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM questions WHERE doc_hash = ?", (doc_hash,))
+                self._conn.commit()
+
+
+# ===============================
+# 🧠 Quiz Generation
+# ===============================
+def iter_quiz(llm, text, doc_hash=None, count=QUIZ_SIZE, bank=None, cache=None, force=False,
+              max_rounds=QUIZ_MAX_ROUNDS):
+    """
+    Yield up to `count` validated, distinct questions as they become available.
+
+    Questions already in the bank for `doc_hash` are served first; with
+    enough of them no model call is made. Otherwise the model is asked only
+    for the missing questions, for at most `max_rounds` rounds. With
+    force=True all questions are new (and different from the banked ones):
+    the prompt lists only the QUIZ_AVOID_MAX most recent ones, so its size
+    stays flat as the bank grows, but every banked question still counts
+    when candidates are deduplicated.
+    """
+    known = bank.questions(doc_hash) if bank is not None and doc_hash else []
+    if not force and len(known) >= count:
+        yield from random.sample(known, count)
+        return
+
+    accepted = [] if force else list(known)
+    yield from accepted
+    material = None
+    new_questions = []
+    for round_number in range(max_rounds):
+        missing = count - len(accepted)
+        if missing <= 0:
+            break
+        if material is None:
+            # Long documents are first condensed into key concepts per section
+            material = condense(llm, text, QUIZ_MAP_PROMPT, "quiz", cache, doc_hash)
+        recent = (known + new_questions)[-QUIZ_AVOID_MAX:] if QUIZ_AVOID_MAX > 0 else []
+        avoid = "\n".join(f"- {question['question']}" for question in recent) or "(none)"
+        prompt = QUIZ_PROMPT.format(count=missing, avoid=avoid, text=material)
+        if cache is None:
+            pieces = (chunk.content for chunk in llm.stream(prompt))
+        else:
+            # A retry round may repeat the previous prompt; its cached answer is what failed
+            pieces = cache.stream(llm, prompt, "quiz-json", doc_hash, force=force or round_number > 0)
+
+        parser = QuizStreamParser()
+        for piece in pieces:
+            for question in _accept(parser.feed(piece), accepted, known, count):
+                new_questions.append(question)
+                yield question
+        for question in _accept(parser.close(), accepted, known, count):
+            new_questions.append(question)
+            yield question
+
+    if bank is not None and doc_hash and new_questions:
+        bank.add(doc_hash, new_questions)
+
+
+def _accept(candidates, accepted, known, count):
+    # Adds distinct candidates to `accepted` until it holds `count` questions
+    taken = []
+    for question in candidates:
+        if len(accepted) >= count:
+            break
+        if is_near_duplicate(question, accepted + known):
+            continue
+        accepted.append(question)
+        taken.append(question)
+    return taken
@@ -0,0 +1,194 @@
+"""
+Hybrid retrieval: dense FAISS search fused with an in-memory BM25 index over
+the same chunks, with optional cross-encoder re-ranking.
+
+Keyword matching catches formulas, symbols and rare terms that embeddings
+tend to blur; reciprocal rank fusion combines both lists without having to
+calibrate FAISS distances against BM25 scores.
+"""
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "4"))
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "20"))
+RERANK_MODEL = os.getenv("RERANK_MODEL")
+
+# Words plus formula-like runs such as "e=mc^2", "x_1" or "f'(x)"
+_TOKEN_RE = re.compile(r"\w+(?:['^_=+\-*/.]+\w+)*")
+_WORD_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        # Also index the parts of compound tokens so "mc^2" matches "mc"
+        parts = _WORD_RE.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class BM25Index:
+    """
+    Append-only inverted index with Okapi BM25 scoring.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)  # term -> [(doc index, term frequency)]
+        self.doc_lens = []
+        self.documents = []
+        self._total_len = 0
+        self._approx_bytes = 0
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore):
+        """
+        Index every chunk of a FAISS vectorstore, in index order.
+        """
+        index = cls()
+        index.add_documents([
+            vectorstore.docstore.search(doc_id)
+            for doc_id in vectorstore.index_to_docstore_id.values()
+        ])
+        return index
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add_documents(self, documents):
+        for document in documents:
+            doc_index = len(self.documents)
+            counts = Counter(tokenize(document.page_content))
+            length = sum(counts.values())
+            # Postings go last so a concurrent search never sees a half-added document
+            self.doc_lens.append(length)
+            self.documents.append(document)
+            for term, tf in counts.items():
+                self.postings[term].append((doc_index, tf))
+            self._total_len += length
+            self._approx_bytes += 48 * len(counts)
+
+    def approx_bytes(self):
+        return self._approx_bytes
+
+    def search(self, query, k=RETRIEVAL_FETCH_K, metadata_filter=None):
+        """
+        Return up to k (document, score) pairs, best first. `metadata_filter`
+        is an optional predicate on the document metadata.
+        """
+        if not self.documents:
+            return []
+        n_docs = len(self.documents)
+        avg_len = self._total_len / n_docs or 1.0
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_index, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lens[doc_index] / avg_len)
+                scores[doc_index] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        results = []
+        for doc_index, score in ranked:
+            document = self.documents[doc_index]
+            if metadata_filter is None or metadata_filter(document.metadata):
+                results.append((document, score))
+                if len(results) == k:
+                    break
+        return results
+
+
+class CrossEncoderReranker:
+    """
+    Local cross-encoder (sentence-transformers) scoring (question, chunk) pairs.
+    """
+
+    def __init__(self, model_name=RERANK_MODEL):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name)
+
+    def rerank(self, question, documents, k):
+        if not documents:
+            return documents
+        scores = self.model.predict([(question, doc.page_content) for doc in documents])
+        ranked = sorted(zip(documents, scores), key=lambda item: item[1], reverse=True)
+        return [doc for doc, _ in ranked[:k]]
+
+
+def reciprocal_rank_fusion(ranked_lists, weights=None, k=60):
+    """
+    Fuse ranked document lists; documents are identified by their text.
+    """
+    weights = weights or [1.0] * len(ranked_lists)
+    scores = defaultdict(float)
+    documents = {}
+    for ranked, weight in zip(ranked_lists, weights):
+        for rank, document in enumerate(ranked):
+            key = document.page_content
+            documents.setdefault(key, document)
+            scores[key] += weight / (k + rank + 1)
+    return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+class HybridRetriever:
+    """
+    Drop-in for `vectorstore.as_retriever()`: `invoke(question)` returns the
+    top `k` chunks from fused dense + BM25 rankings. `metadata_filter` is
+    passed to both searches as `filter` / `metadata_filter`.
+    """
+
+    def __init__(self, vectorstore, bm25, k=RETRIEVAL_K, fetch_k=RETRIEVAL_FETCH_K,
+                 dense_weight=1.0, sparse_weight=1.0, reranker=None, metadata_filter=None):
+        self.vectorstore = vectorstore
+        self.bm25 = bm25
+        self.k = k
+        self.fetch_k = fetch_k
+        self.weights = [dense_weight, sparse_weight]
+        self.reranker = reranker
+        self.metadata_filter = metadata_filter
+
+    def invoke(self, question):
+        search_kwargs = {"filter": self.metadata_filter} if self.metadata_filter is not None else {}
+        dense = [
+            doc for doc, _ in self.vectorstore.similarity_search_with_score(question, k=self.fetch_k, **search_kwargs)
+        ]
+        sparse = [doc for doc, _ in self.bm25.search(question, self.fetch_k, self.metadata_filter)]
+        fused = reciprocal_rank_fusion([dense, sparse], self.weights)
+        if self.reranker is not None:
+            # Re-rank a short head of the fused list; cross-encoders are costly
+            return self.reranker.rerank(question, fused[:self.k * 3], self.k)
+        return fused[:self.k]
+
+
+def source_label(document):
+    """
+    Citation label for a chunk, e.g. "notes.pdf p.3" or "notes.pdf p.3-4",
+    or "" if unknown.
+    """
+    metadata = document.metadata or {}
+    parts = [metadata["doc_name"]] if metadata.get("doc_name") else []
+    if metadata.get("page") and metadata.get("page_end"):
+        parts.append(f"p.{metadata['page']}-{metadata['page_end']}")
+    elif metadata.get("page"):
+        parts.append(f"p.{metadata['page']}")
+    return " ".join(parts)
+
+
+def format_context(documents):
+    """
+    Join retrieved chunks for the prompt, each prefixed with its citation label.
+    """
+    blocks = []
+    for document in documents:
+        label = source_label(document)
+        blocks.append(f"[{label}]\n{document.page_content}" if label else document.page_content)
+    return "\n\n".join(blocks)
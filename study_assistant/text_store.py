@@ -0,0 +1,224 @@
+"""
+Extracted document text on disk, shared by reference.
+
+Every session working with a document used to keep its full text in
+session state. Now the text is written once per document to
+`<root>/<doc hash>.txt` and read through a memory map, and sessions hold a
+TextHandle: a few bytes that turn into the text (or its first N
+characters) only while a summary, quiz or prompt is being built. Open maps
+are kept in an LRU cache under a byte budget, so they are evicted like any
+other cache entry. With `max_disk_bytes` the files are capped too: the least
+recently used ones (by modification time, refreshed on use) are removed
+once a new text pushes the store over the cap.
+"""
+import mmap
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from study_assistant.cache import LRUCache
+
+DEFAULT_ROOT = ".text_store"
+PAGE_SEPARATOR = "\n\n"
+
+
+class TextHandle:
+    """
+    Lazy, shareable stand-in for a document's text.
+
+    `read(limit=None)` returns the text (at least its first `limit`
+    characters); `size` is its approximate length. str(handle) reads it all,
+    handle[:n] only what the slice needs.
+    """
+
+    __slots__ = ("_read", "size", "path")
+
+    def __init__(self, read, size, path=None):
+        self._read = read
+        self.size = size
+        self.path = path
+
+    def __len__(self):
+        return self.size
+
+    def __str__(self):
+        return self._read()
+
+    def __getitem__(self, key):
+        if isinstance(key, slice) and not key.start and key.stop is not None and key.stop >= 0:
+            return self._read(key.stop)[key]
+        return self._read()[key]
+
+    def __repr__(self):
+        return f"TextHandle(size={self.size}, path={self.path!r})"
+
+
+def as_text(text):
+    """
+    The string behind `text`, which may be a str or a TextHandle.
+    """
+    return text if isinstance(text, str) else str(text)
+
+
+class PageSpool:
+    """
+    Page texts appended to an anonymous temporary file as they are extracted
+    (in any order) and read back in page order, so a running ingestion does
+    not keep every page's text in memory. Safe to read while pages are added.
+    """
+
+    def __init__(self, dir=None):
+        self._file = tempfile.TemporaryFile(dir=dir)
+        self._pages = {}  # page number -> (offset, length)
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def __len__(self):
+        return len(self._pages)
+
+    def add(self, record):
+        if not record.text.strip():
+            return
+        data = record.text.encode("utf-8")
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            self._pages[record.number] = (self._file.tell(), len(data))
+            self._file.write(data)
+            self.size += len(data)
+
+    def iter_texts(self):
+        with self._lock:
+            pages = sorted(self._pages.items())
+        for _, (offset, length) in pages:
+            with self._lock:
+                self._file.seek(offset)
+                data = self._file.read(length)
+            yield data.decode("utf-8")
+
+    def text(self, limit=None):
+        """
+        The pages joined like join_pages(); with `limit`, only about that many
+        characters are read.
+        """
+        parts, size = [], 0
+        for text in self.iter_texts():
+            if limit is not None and size >= limit:
+                break
+            parts.append(text)
+            size += len(text) + len(PAGE_SEPARATOR)
+        return PAGE_SEPARATOR.join(parts)
+
+    def handle(self):
+        # Pages added later are included when the handle is read
+        return TextHandle(self.text, self.size)
+
+
+class TextStore:
+    """
+    Per-document text files read through shared, budgeted memory maps.
+    """
+
+    def __init__(self, root=DEFAULT_ROOT, max_open_bytes=None, budget=None, max_disk_bytes=None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_disk_bytes = max_disk_bytes
+        self._maps = LRUCache(max_entries=64, max_bytes=max_open_bytes, sizeof=len, budget=budget)
+
+    def _path(self, doc_hash):
+        return self.root / f"{doc_hash}.txt"
+
+    def __contains__(self, doc_hash):
+        return self._path(doc_hash).exists()
+
+    def get(self, doc_hash):
+        """
+        TextHandle for a stored document, or None if it is not stored.
+        """
+        path = self._path(doc_hash)
+        try:
+            size = path.stat().st_size
+            os.utime(path)  # marks it recently used for cap()
+        except OSError:
+            return None
+        return TextHandle(lambda limit=None: self.read(doc_hash, limit), size, path)
+
+    def put(self, doc_hash, text):
+        return self.put_pages(doc_hash, [text])
+
+    def put_pages(self, doc_hash, texts):
+        """
+        Write the texts joined by blank lines (like join_pages) without
+        building the joined string, e.g. from PageSpool.iter_texts(); returns
+        the document's TextHandle.
+        """
+        tmp_file = tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=self.root, prefix=f".{doc_hash}-", delete=False
+        )
+        try:
+            with tmp_file:
+                first = True
+                for text in texts:
+                    if not first:
+                        tmp_file.write(PAGE_SEPARATOR)
+                    tmp_file.write(text)
+                    first = False
+            os.replace(tmp_file.name, self._path(doc_hash))
+        finally:
+            if os.path.exists(tmp_file.name):
+                os.unlink(tmp_file.name)
+        # A map of the previous version must not be served any more
+        self._maps.pop(doc_hash)
+        if self.max_disk_bytes is not None:
+            self.cap(self.max_disk_bytes, keep=doc_hash)
+        return self.get(doc_hash)
+
+    def _map(self, doc_hash):
+        mapped = self._maps.get(doc_hash)
+        if mapped is None:
+            with open(self._path(doc_hash), "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return b""
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            os.utime(self._path(doc_hash))
+            self._maps.put(doc_hash, mapped)
+        return mapped
+
+    def read(self, doc_hash, limit=None):
+        mapped = self._map(doc_hash)
+        # Decoded straight from the map, without an intermediate bytes copy
+        with memoryview(mapped) as view:
+            if limit is None:
+                return str(view, "utf-8")
+            # A UTF-8 character is at most 4 bytes; a cut multi-byte character is dropped
+            with view[:limit * 4] as head:
+                return str(head, "utf-8", "ignore")[:limit]
+
+    def remove(self, doc_hash):
+        self._maps.pop(doc_hash)
+        self._path(doc_hash).unlink(missing_ok=True)
+
+    def cap(self, max_bytes, keep=None):
+        """
+        Remove least recently used texts until the store fits in `max_bytes`.
+        `keep` and texts with an open map (in use right now) are never removed.
+        Returns the removed document hashes.
+        """
+        files = []
+        for path in self.root.glob("*.txt"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path.stem))
+        total = sum(size for _, size, _ in files)
+        removed = []
+        for _, size, doc_hash in sorted(files):
+            if total <= max_bytes:
+                break
+            if doc_hash == keep or doc_hash in self._maps:
+                continue
+            self.remove(doc_hash)
+            total -= size
+            removed.append(doc_hash)
+        return removed
@@ -0,0 +1,45 @@
+from study_assistant.chunking import StructuredChunker
+from study_assistant.extract import OCR, TEXT_LAYER, PageRecord
+
+
+def _page(number, source):
+    body = " ".join(f"Sentence {number}.{i} about topic {number} goes here." for i in range(12))
+    return PageRecord(number, f"{number} Topic {number}\n\n{body}", source)
+
+
+def test_late_ocr_page_is_chunked_on_its_own():
+    # Mixed PDF: text-layer pages stream first, the OCR'd page 4 arrives last
+    pages = {number: _page(number, OCR if number == 4 else TEXT_LAYER) for number in range(1, 9)}
+    arrival = [1, 2, 3, 5, 6, 7, 4, 8]
+    chunker = StructuredChunker(chunk_size=400)
+    documents = []
+    for start in range(0, len(arrival), 3):
+        documents += chunker.feed([pages[number] for number in arrival[start:start + 3]])
+    documents += chunker.finish()
+
+    for document in documents:
+        assert document.metadata.get("page_end", document.metadata["page"]) >= document.metadata["page"]
+
+    page_four = [document for document in documents if "topic 4 " in document.page_content]
+    assert page_four
+    for document in page_four:
+        assert document.metadata["page"] == 4
+        assert "page_end" not in document.metadata
+        assert document.metadata["heading"] == "4 Topic 4"
+        assert document.metadata["source"] == OCR
+    for number in (1, 2, 3, 5, 6, 7, 8):
+        assert any(f"topic {number} " in document.page_content for document in documents)
+
+
+def test_text_pages_are_not_held_back_by_a_scanned_cover():
+    chunker = StructuredChunker(chunk_size=400)
+    early = []
+    for number in range(2, 40):
+        early += chunker.feed([_page(number, TEXT_LAYER)])
+    assert early and max(document.metadata["page"] for document in early) > 30
+
+    cover = chunker.feed([PageRecord(1, "Lecture Notes\n\nAn introduction to the course and its topics.", OCR)])
+    cover += chunker.finish()
+    cover_chunks = [document for document in cover if document.metadata["page"] == 1]
+    assert cover_chunks and all(document.metadata["source"] == OCR for document in cover_chunks)
+    assert all("Lecture Notes" not in document.page_content for document in early)
@@ -0,0 +1,35 @@
+from study_assistant.chunking import StructuredChunker
+from study_assistant.corpus import Corpus, DocFilter
+from study_assistant.embeddings import HashingEmbeddings
+from study_assistant.extract import TEXT_LAYER, PageRecord
+
+TOPICS = ["photosynthesis chlorophyll", "eigenvalue matrix", "mitochondria respiration"]
+
+
+def _pages(topic, count=4):
+    return [
+        PageRecord(number, " ".join(f"Sentence {number}.{i} is about {topic} in detail." for i in range(20)),
+                   TEXT_LAYER)
+        for number in range(1, count + 1)
+    ]
+
+
+def test_open_shard_documents_survive_a_reload(tmp_path):
+    corpus = Corpus(tmp_path, HashingEmbeddings(), shard_size=1000)
+    for index, topic in enumerate(TOPICS):
+        corpus.add_document(f"doc{index}", f"{topic}.pdf", _pages(topic), StructuredChunker(chunk_size=300))
+
+    reloaded = Corpus(tmp_path, HashingEmbeddings(), shard_size=1000)
+    assert reloaded.documents == corpus.documents
+    assert [shard.index.ntotal for shard in reloaded.shards] == [meta["chunks"] for meta in reloaded.shard_meta]
+    assert reloaded.shards[0].index.ntotal == len(reloaded.shards[0].index_to_docstore_id)
+
+    for index, topic in enumerate(TOPICS):
+        results = reloaded.similarity_search_with_score(topic, k=3, filter=DocFilter([f"doc{index}"]))
+        assert results
+        assert all(doc.metadata["doc_id"] == f"doc{index}" and topic in doc.page_content for doc, _ in results)
+
+    # A document added after the reload lines up FAISS positions with its own chunks
+    reloaded.add_document("doc3", "entropy.pdf", _pages("entropy thermodynamics"), StructuredChunker(chunk_size=300))
+    results = reloaded.similarity_search_with_score("entropy thermodynamics", k=3, filter=DocFilter(["doc3"]))
+    assert results and all("entropy" in doc.page_content for doc, _ in results)
@@ -0,0 +1,41 @@
+import pdfplumber
+
+from study_assistant.cache import LRUCache
+from study_assistant.extract import iter_page_records, page_fingerprint
+
+
+def _form_pdf(path, text):
+    # One page whose content only draws form XObject /X1; the text lives in the form
+    form = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R"
+        b" /Resources << /XObject << /X1 5 0 R >> >> >>",
+        b"<< /Length 10 >>\nstream\nq /X1 Do Q\nendstream",
+        b"<< /Type /XObject /Subtype /Form /BBox [0 0 612 792] /Resources << /Font << /F1 6 0 R >> >>"
+        b" /Length %d >>\nstream\n%s\nendstream" % (len(form), form),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(bytes(data))
+    return path
+
+
+def test_pages_differing_only_inside_a_form_xobject_do_not_share_cache_entries(tmp_path):
+    first = _form_pdf(tmp_path / "first.pdf", "Alpha lecture notes on photosynthesis and chlorophyll")
+    second = _form_pdf(tmp_path / "second.pdf", "Beta lecture notes on eigenvalues and eigenvectors")
+    with pdfplumber.open(first) as a, pdfplumber.open(second) as b:
+        assert page_fingerprint(a.pages[0]) != page_fingerprint(b.pages[0])
+
+    cache = LRUCache()
+    assert "Alpha" in list(iter_page_records(str(first), cache))[0].text
+    assert "Beta" in list(iter_page_records(str(second), cache))[0].text